@@ -13,28 +13,53 @@ import os,math
 try:
     import tkinter as tk
     from tkinter import *
-except:
-    import Tkinter as tk
-    from Tkinter import *
+except ImportError:
+    try:
+        import Tkinter as tk
+        from Tkinter import *
+    except ImportError:
+        # headless use without Tk (python -m Caver3.batch)
+        tk = None
 
 try:
     from tkinter import filedialog
-except:
-    import tkFileDialog as filedialog
+except ImportError:
+    try:
+        import tkFileDialog as filedialog
+    except ImportError:
+        filedialog = None
 
-import Pmw
-import distutils.spawn # used for find_executable
-from pymol import cmd,selector
 import sys
-from pymol.cmd import _feedback,fb_module,fb_mask,is_list,_cmd
-from pymol.cgo import *
-from chempy.models import Indexed
-from chempy import Bond, Atom
+try:
+    import Pmw
+    from pymol import cmd,selector
+    from pymol.cmd import _feedback,fb_module,fb_mask,is_list,_cmd
+    from pymol.cgo import *
+    from chempy.models import Indexed
+    from chempy import Bond, Atom
+    from pymol import stored
+except ImportError:
+    # headless use without PyMOL (python -m Caver3.batch)
+    Pmw = None
 import threading
 #import subprocess
+from .jobs import CaverJob
+from . import jvm
+from . import scheduler
+from . import heapmodel
+from . import recovery
+from . import recluster
+from . import clustertree
+from . import export
+from . import crop
+from . import chunks
+from . import checkpoint
+from . import incremental
+from . import plots
+from .configfile import config_values, update_config
+from .resultcache import ResultCache, job_key
 
 import shutil
-from pymol import stored
 import time
 #
 # Global config variables
@@ -99,6 +124,7 @@ except ImportError:
 
 # pridani do menu
 def __init__(self):
+    jvm.discover_async()
     lbb = "Caver %s" % (VERSION,)
     self.menuBar.addmenuitem('Plugin', 'command',
                              'Launch Caver '  + VERSION,
@@ -113,11 +139,15 @@ defaults = {
     "compute_command": 'Compute tunnels',
     "warn_command": 'Show warnings',
     "exit_command": 'Exit',
+    "cancel_command": 'Cancel computation',
     "default_shell_depth": '2',
     "default_shell_radius": '3.0',
     "default_tunnels_probe": '0.7',
     "default_java_heap": '6000',
+    "default_result_cache_mb": '2000',
+    "default_crop_radius": '30',
     "default_clustering_threshold": '1.5',
+    "default_top_clusters": '10',
     "surroundings" : 'sele',
     "startingacids":('117','283','54'),
     "default_block": '10.0'
@@ -178,13 +208,26 @@ class DataStruct:
 
 class PyJava:
 
+    # False when running without GUI, errors are printed instead of shown in dialogs
+    interactive = True
+    # memory and cores shared by all Java launches, None = scheduler.default_budget()
+    budget = None
+    cpus = scheduler.JOB_CPUS
+
+    def error(self, msg):
+        if self.interactive and Pmw is not None:
+            Pmw.MessageDialog(title='Error', message_text=msg)
+        else:
+            print("ERROR: " + msg)
+
     def status(self, r):
         if 0 == r:
             print("OK")
         else:
             print("FAIL")
 
-    def __init__(self, maxXmx, caverfolder, caverjar, outdirInputs, cfgnew, out_dir):
+    # without outdirInputs, only Java is tested and the heap and CDS archive are prepared
+    def __init__(self, maxXmx, caverfolder, caverjar, outdirInputs=None, cfgnew=None, out_dir=None):
         self.insufficient_memory = False
         self.jar = caverjar
         print("")
@@ -199,44 +242,181 @@ class PyJava:
         print("")
         print("*** Optimizing memory allocation for Java ***")
         self.optimize_memory(maxXmx)
-        self.cmd = [
-            "java",
+        # the first job of a new caver.jar or JVM starts while its archive is built
+        self.cds = jvm.cds_archive(self.info, caverjar, VERSION)
+        if outdirInputs is None:
+            return
+        self.caverfolder = caverfolder
+        self.inputs = outdirInputs
+        self.cfg = cfgnew
+        self.original_cfg = cfgnew
+        self.out_dir = out_dir
+        self.attempt = 1
+        self.reduced = False
+        # accuracy tier changes of the config (see recovery.py)
+        self.accuracy = {}
+        self.max_xmx = self.xmx
+        self.features = heapmodel.job_features(outdirInputs, cfgnew)
+        self.xmx = heapmodel.estimate(self.features, self.max_xmx)
+        print("*** Estimated Java heap for this job: " + str(self.xmx) + " MB ***")
+        self.build_cmd()
+
+    def build_cmd(self):
+        self.gc_log = os.path.join(self.out_dir, jvm.GC_LOG)
+        self.cmd = [self.java] + jvm.launch_profile(self.info, self.xmx, self.cpus) + jvm.cds_flags(self.cds) + \
+            jvm.gc_log_flags(self.info, self.gc_log) + [
             "-Xmx%dm" % self.xmx,
-            "-cp", os.path.join(caverfolder, "lib"),
-            "-jar", caverjar,
-            "-home", caverfolder,
-            "-pdb", outdirInputs,
-            "-conf", cfgnew,
-            "-out", out_dir,
+            "-cp", os.path.join(self.caverfolder, "lib"),
+            "-jar", self.jar,
+            "-home", self.caverfolder,
+            "-pdb", self.inputs,
+            "-conf", self.cfg,
+            "-out", self.out_dir,
         ]
         print("*** Caver will be called using command ***")
-        print(" ".join([ '"%s"' % t if t != "java" and t[0] != "-" else t for t in self.cmd]))
+        print(" ".join([ '"%s"' % t if t != self.java and t[0] != "-" else t for t in self.cmd]))
         print("******************************************")
 
+    # prepares the next attempt after the job ran out of memory, False when giving up
+    def retry_after_oom(self):
+        balls = int(config_values(self.cfg).get("number_of_approximating_balls", 12))
+        attempt = recovery.next_attempt(self.attempt, self.xmx, self.max_xmx, balls)
+        if attempt is None:
+            return False
+        self.attempt += 1
+        self.xmx, tier = attempt
+        if tier:
+            self.reduced = True
+            self.accuracy = tier
+        # every attempt starts from the config of the job, earlier attempts may have loaded stages
+        changes = dict(self.accuracy)
+        stages = checkpoint.completed(self.out_dir)
+        resumed = False
+        if not self.accuracy and stages:
+            # a larger heap gives the same results, completed stages are loaded,
+            # stages the job loads on purpose stay loaded
+            for key, value in checkpoint.resume_changes(stages).items():
+                if value == "yes":
+                    changes[key] = value
+            resumed = True
+            print("*** Resuming after stages: " + ", ".join(stages) + " ***")
+        cfg = self.original_cfg
+        if changes:
+            cfg = recovery.retry_config(self.original_cfg, self.attempt)
+            update_config(self.original_cfg, cfg, changes)
+        self.cfg = cfg
+        self.features = heapmodel.job_features(self.inputs, self.cfg)
+        keep = recovery.KEPT
+        if config_values(self.cfg).get("load_tunnels") == "yes":
+            # tunnels linked from a previous run (see recluster.py) or completed by this one
+            keep = keep + ("data",)
+        if resumed:
+            keep = keep + (checkpoint.STAGE_FILE,)
+        # configs of trajectory chunks are kept in their output directories
+        for path in (self.original_cfg, self.cfg):
+            if os.path.dirname(os.path.abspath(path)) == os.path.abspath(self.out_dir):
+                keep = keep + (os.path.basename(path),)
+        recovery.clean_out_dir(self.out_dir, keep)
+        self.insufficient_memory = False
+        print("")
+        print("*** Out of memory, retrying: " + recovery.describe(self.attempt, self.xmx, self.cfg) + " ***")
+        self.build_cmd()
+        return True
+
+    # results computed with fewer approximating balls than requested
+    def degraded(self):
+        return self.reduced
+
     def java_present(self):
-        cmd = ["java", "-version"]
-        r = self.execute(cmd, False)
-        return r
+        self.info = jvm.session_info()
+        if self.info is None:
+            # let execute report why java cannot be started
+            cmd = ["java", "-version"]
+            r = self.execute(cmd, False)
+            return r if r else -1
+        self.java = self.info.java
+        self.java_version = self.info.version
+        print(self.info.describe())
+        print("(discovered once per session, 'java -version' skipped, saved %.2f s)" % self.info.seconds)
+        return 0
 
     def run_caver(self):
-        self.execute(self.cmd, False)
+        job = CaverJob(self.cmd, queued=False)
+        job.add_listener(lambda line: sys.stdout.write(line + "\n"))
+        job.add_listener(self.analyze)
+        self.launch(job)
+        return job.wait()
+
+    # non-blocking variant, the output is available through job.read_lines()
+    def start_caver(self, log_file=None, queued=True, listeners=()):
+        job = CaverJob(self.cmd, log_file, queued)
+        job.add_listener(self.analyze)
+        for listener in listeners:
+            job.add_listener(listener)
+        return self.launch(job)
+
+    # the job waits until the budget has enough free memory and cores
+    def launch(self, job):
+        job.add_finish_callback(self.record_run)
+        job.add_finish_callback(self.record_attempt)
+        recorder = checkpoint.StageRecorder(self.out_dir)
+        job.add_listener(recorder.line)
+        job.add_finish_callback(recorder.finished)
+        budget = self.budget
+        if budget is None:
+            budget = scheduler.default_budget()
+        return scheduler.launch(job, budget, self.xmx + scheduler.JVM_OVERHEAD_MB, self.cpus)
+
+    # heap use reported by the garbage collector, resident memory of a JVM
+    # with the heap committed up front (-Xms) follows -Xmx, not the job
+    def record_run(self, job):
+        if job.cancelled or job.returncode is None:
+            return
+        peak = jvm.gc_peak_mb(self.gc_log)
+        if peak is None and job.peak_mb is not None and self.xmx < jvm.BIG_HEAP:
+            # no collection ran, the peak memory includes the JVM overhead besides heap
+            peak = max(0, job.peak_mb - scheduler.JVM_OVERHEAD_MB)
+        if peak is None and not self.insufficient_memory:
+            return
+        heapmodel.record(self.features, self.xmx, peak, self.insufficient_memory)
+
+    # recovery.txt is written once a job ran out of memory
+    def record_attempt(self, job):
+        if job.cancelled or job.returncode is None:
+            return
+        if self.insufficient_memory:
+            result = "out of memory"
+        elif job.returncode == 0:
+            result = "ok"
+        else:
+            result = "failed (%s)" % job.returncode
+        if self.attempt > 1 or self.insufficient_memory:
+            recovery.record(self.out_dir, self.attempt, self.xmx, self.cfg, result)
 
     def optimize_memory(self, s_max_xmx):
         max_xmx = int(s_max_xmx)
-        values = [500, 800, 900, 950, 1000, 1050, 1100, 1150, 1200, 1250, 1300, 1400, 1500, 2000, 3000, 4000, 5000, 6000, 8000, 10000, 14000, 16000, 20000, 32000, 48000, 64000]
-        values.append(max_xmx)
-        values.sort()
-        #sorted(values)
-        self.xmx = values[0]
-        for xmx in values:
-            if int(xmx) <= max_xmx:
-                cmd = ["java", "-Xmx%dm" % xmx, "-jar", self.jar, "do_nothing"]
-                code = self.execute(cmd, True)
-                if 0 == code:
-                    self.xmx = xmx
-                    print("Xmx: " + str(self.xmx))
-        print("*** Memory for Java: " + str(self.xmx) + " MB ***")
-        print
+        cached = jvm.cached_heap(self.java, self.java_version, max_xmx)
+        if cached is not None:
+            self.xmx = cached
+            print("*** Memory for Java: " + str(self.xmx) + " MB (cached probe) ***")
+            return
+        values = jvm.heap_candidates(max_xmx)
+        self.probe_seconds = 0
+        xmx = jvm.largest_working(values, self.heap_works)
+        if xmx is None:
+            self.xmx = values[0]
+        else:
+            self.xmx = xmx
+            jvm.store_heap(self.java, self.java_version, max_xmx, xmx)
+        print("*** Memory for Java: " + str(self.xmx) + " MB (probed in %.2f s) ***" % self.probe_seconds)
+
+    def heap_works(self, xmx):
+        start = time.time()
+        cmd = [self.java] + jvm.quick_profile(self.info) + ["-Xmx%dm" % xmx, "-jar", self.jar, "do_nothing"]
+        code = self.execute(cmd, True)
+        self.probe_seconds += time.time() - start
+        print("Xmx: " + str(xmx) + (" OK" if 0 == code else " FAIL"))
+        return 0 == code
 
     def execute_old(self, cmd):
         p = os.popen(cmd)
@@ -246,26 +426,27 @@ class PyJava:
         return 1
 
     def execute(self, args, silent):
+        self.output = ""
         if True:
             import subprocess
             try:
                 p = subprocess.check_output(args, stderr=subprocess.STDOUT, stdin=subprocess.PIPE)
+                self.output = p.decode('UTF-8')
                 if not silent:
-                    print(p.decode('UTF-8'))
+                    print(self.output)
             except subprocess.CalledProcessError as e:
                 if not silent:
                     print(e)
                     print(e.cmd)
                     print(e.output)
-                self.analyze(e.output.decode('UTF-8'))
+                self.output = e.output.decode('UTF-8')
+                self.analyze(self.output)
                 return e.returncode
             except OSError as e:
-                error_dialog = Pmw.MessageDialog(title='Error',
-                    message_text="Can't execute " + str(args) + "\n\n" + str(e))
+                self.error("Can't execute " + str(args) + "\n\n" + str(e))
                 return -1
             except Exception as e:
-                error_dialog = Pmw.MessageDialog(title='Error',
-                    message_text="Unknown error: " + str(e))
+                self.error("Unknown error: " + str(e))
                 return -2
             return 0
 
@@ -273,6 +454,30 @@ class PyJava:
         if 'OutOfMemory' in output:
             self.insufficient_memory = True
 
+# creates next numbered directory dir/caver_output/N
+def allocate_out_dir(dir):
+    if not os.path.exists(dir):
+        os.mkdir(dir)
+    dir = dir.replace("\\","/")
+    if (dir.endswith("/")):
+        dir = dir[:-1]
+    out_home = dir + "/caver_output/"
+    if not os.path.exists(out_home):
+        os.mkdir(out_home)
+
+    max = 0
+    ls = os.listdir(out_home)
+    for f in ls:
+        fn = os.path.basename(f)
+        if fn.isdigit():
+            i = int(fn)
+            if max < i:
+                max = i
+
+    new_dir = out_home + str(max + 1)
+    os.makedirs(new_dir)
+    return out_home, new_dir
+
 class AnBeKoM:
 
     def pop_error(self, msg):
@@ -301,11 +506,13 @@ class AnBeKoM:
 
         # Create the dialog.
         self.dialog = Pmw.Dialog(parent,
-                                 buttons = (defaults["compute_command"], defaults["exit_command"]),
+                                 buttons = (defaults["compute_command"], defaults["cancel_command"], defaults["exit_command"]),
                                  #defaultbutton = 'Run CAVER',
                                  title = 'Caver ' + VERSION,
                                  command = self.execute)
         self.dialog.withdraw()
+        self.job = None
+        self.setJobButtons(False)
         lbb = "Caver %s" % (VERSION,)
 
         w = tk.Label(self.dialog.interior(),
@@ -347,6 +554,18 @@ class AnBeKoM:
 
 
         self.binlocation.pack(fill='x',padx=4,pady=1) # vertical
+        self.reclusterFrame = tk.Frame(self.dialog.interior())
+        self.reclusterVar = IntVar()
+        self.reclusterVar.set(0)
+        self.reclusterCheck = Checkbutton(self.reclusterFrame, text="Re-cluster previous run:", variable=self.reclusterVar)
+        self.reclusterCheck.pack(side=LEFT)
+        self.reclusterRun = Pmw.EntryField(self.reclusterFrame, value = "")
+        self.reclusterRun.pack(side=LEFT, fill='x', expand=1, padx=4)
+        self.reclusterBrowse = tk.Button(self.reclusterFrame, text = 'Browse', command = self.reclusterChoose)
+        self.resumeButton = tk.Button(self.reclusterFrame, text = 'Resume interrupted', command = self.resumeRun)
+        self.resumeButton.pack(side=RIGHT)
+        self.reclusterBrowse.pack(side=RIGHT)
+        self.reclusterFrame.pack(fill='x',padx=4,pady=1)
         self.configgroup = Pmw.Group(self.dialog.interior(), tag_text='Configuration save/load')
         self.conflocationDefault = os.path.join(self.caver3locationAbsolute,"config.txt")
         self.DEFCONF = "(default config used)"
@@ -369,6 +588,25 @@ class AnBeKoM:
                                      value = defaults["default_java_heap"],
                                      label_text = 'Maximum Java heap size (MB):')
         self.javaHeap.pack(fill='x',padx=4,pady=1) # vertical
+        self.useCacheVar = IntVar()
+        self.useCacheVar.set(1)
+        self.useCache = Checkbutton(self.dialog.interior(), text="Reuse results of identical computations", variable=self.useCacheVar)
+        self.useCache.pack(anchor=W,padx=4,pady=1)
+        self.incrementalVar = IntVar()
+        self.incrementalVar.set(1)
+        self.incremental = Checkbutton(self.dialog.interior(), text="Recompute only stages affected by changed parameters", variable=self.incrementalVar)
+        self.incremental.pack(anchor=W,padx=4,pady=1)
+
+        self.lazyPlotsVar = IntVar()
+        # opt-in, the images requested by the loaded config are drawn by Java otherwise
+        self.lazyPlotsVar.set(0)
+        self.lazyPlots = Checkbutton(self.dialog.interior(), text="Draw heat maps and histograms only when they are opened", variable=self.lazyPlotsVar)
+        self.lazyPlots.pack(anchor=W,padx=4,pady=1)
+
+        self.retryOomVar = IntVar()
+        self.retryOomVar.set(1)
+        self.retryOom = Checkbutton(self.dialog.interior(), text="Retry automatically when out of memory (larger heap, then fewer approximating balls)", variable=self.retryOomVar)
+        self.retryOom.pack(anchor=W,padx=4,pady=1)
         self.tunnelsProbe = Pmw.EntryField(self.dialog.interior(),
                                      labelpos='w',
                                      value = defaults["default_tunnels_probe"],
@@ -397,6 +635,20 @@ class AnBeKoM:
 
 
         self.clusteringThreshold.pack(fill='x',padx=4,pady=1) # vertical
+        self.thresholdFrame = tk.Frame(self.dialog.interior())
+        self.thresholdScale = Scale(self.thresholdFrame, orient=HORIZONTAL, resolution=0.05, from_=0, to=10,
+                                    showvalue=1, command=self.thresholdDragged, state=DISABLED)
+        self.thresholdScale.pack(side=LEFT, fill='x', expand=1)
+        self.thresholdInfo = tk.Label(self.thresholdFrame, text="(cluster tree of the last run)")
+        self.thresholdInfo.pack(side=LEFT, padx=4)
+        self.thresholdFrame.pack(fill='x',padx=4,pady=1)
+        self.clusterTree = None
+        self.topClusters = Pmw.EntryField(self.dialog.interior(),
+                                     labelpos='w',
+                                     value = defaults["default_top_clusters"],
+                                     label_text = 'Load top clusters (0 = all):',
+                                     validate = {'validator' : 'integer', 'min' : 0})
+        self.topClusters.pack(fill='x',padx=4,pady=1)
         self.approxLbl = Label(self.dialog.interior(), text="Number of approximating balls:")
         self.approxLbl.pack()
         self.approxVar = StringVar()
@@ -429,6 +681,39 @@ class AnBeKoM:
 
         self.filterGroup = Pmw.Group(self.dialog.interior(), tag_text='Input atoms:')
         self.filterGroup.pack()
+        self.stripFrame = tk.Frame(self.dialog.interior())
+        self.stripHydrogensVar = IntVar()
+        self.stripHydrogensVar.set(0)
+        Checkbutton(self.stripFrame, text="Remove hydrogens", variable=self.stripHydrogensVar).pack(side=LEFT)
+        self.stripWatersVar = IntVar()
+        self.stripWatersVar.set(0)
+        Checkbutton(self.stripFrame, text="Remove waters", variable=self.stripWatersVar).pack(side=LEFT)
+        self.stripAltlocsVar = IntVar()
+        self.stripAltlocsVar.set(0)
+        Checkbutton(self.stripFrame, text="First alternate locations only", variable=self.stripAltlocsVar).pack(side=LEFT)
+        self.stripFrame.pack()
+        self.cropFrame = tk.Frame(self.dialog.interior())
+        self.cropVar = IntVar()
+        self.cropVar.set(0)
+        Checkbutton(self.cropFrame, text="Crop around starting point, radius (A):", variable=self.cropVar).pack(side=LEFT)
+        self.cropRadius = Pmw.EntryField(self.cropFrame, value = defaults["default_crop_radius"], entry_width = 6,
+                                         validate = {'validator': 'real', 'min': 1})
+        self.cropRadius.pack(side=LEFT)
+        self.cropFrame.pack()
+        self.trajectoryFrame = tk.Frame(self.dialog.interior())
+        self.trajectoryVar = IntVar()
+        self.trajectoryVar.set(0)
+        Checkbutton(self.trajectoryFrame, text="Analyze all states of the model (trajectory), every N-th state, N:", variable=self.trajectoryVar).pack(side=LEFT)
+        self.trajectoryStep = Pmw.EntryField(self.trajectoryFrame, value = '1', entry_width = 6,
+                                             validate = {'validator': 'integer', 'min': 1})
+        self.trajectoryStep.pack(side=LEFT)
+        tk.Label(self.trajectoryFrame, text="parallel chunks:").pack(side=LEFT)
+        self.trajectoryChunks = Pmw.EntryField(self.trajectoryFrame, value = '1', entry_width = 4,
+                                               validate = {'validator': 'integer', 'min': 1})
+        self.trajectoryChunks.pack(side=LEFT)
+        self.trajectoryFrame.pack()
+        self.snapshots = None
+        self.cropSphere = None
         self.checklist = []
         self.buttonlist = []
 
@@ -533,6 +818,12 @@ class AnBeKoM:
         self.aftercomp.pack(side=LEFT,padx=4,pady=1)
         self.afterbutt = tk.Button(self.egroup.interior(), text='Details', command=self.details, width = 5)
         self.afterbutt.pack(side=RIGHT,padx=4,pady=1)
+        self.plotsbutt = tk.Button(self.egroup.interior(), text='Plots', command=self.showPlots, width = 5)
+        self.plotsbutt.pack(side=RIGHT,padx=4,pady=1)
+        self.plotsbutt.config(state=DISABLED)
+        self.morebutt = tk.Button(self.egroup.interior(), text='More clusters', command=self.showPendingClusters)
+        self.morebutt.pack(side=RIGHT,padx=4,pady=1)
+        self.morebutt.config(state=DISABLED)
         self.afterbutt.config(state=DISABLED)
     #hide group for now
         self.egroup.pack_forget()
@@ -603,6 +894,64 @@ class AnBeKoM:
         fc = self.loadFileContent("%s/warnings.txt" % (self.out_dir))
         error_dialog = Pmw.MessageDialog(self.parent,title = 'Information', message_text = fc,)
 
+    # plots of the last run, rendered from its CSV files when selected
+    def showPlots(self):
+        window = tk.Toplevel(self.parent)
+        window.title("CAVER plots - " + self.out_dir)
+        items = plots.available(self.out_dir)
+        listbox = tk.Listbox(window, width=36, exportselection=0)
+        for title, name in items:
+            listbox.insert(tk.END, title)
+        listbox.pack(side=LEFT, fill=tk.Y, padx=4, pady=4)
+        canvas = Pmw.ScrolledCanvas(window, canvas_width=600, canvas_height=400)
+        canvas.pack(side=LEFT, fill=tk.BOTH, expand=1, padx=4, pady=4)
+        cfg = recluster.run_config(self.out_dir)
+
+        def selected(event):
+            if not listbox.curselection():
+                return
+            name = items[int(listbox.curselection()[0])][1]
+            try:
+                path = plots.render(self.out_dir, name, cfg)
+            except (IOError, OSError, ValueError, KeyError, IndexError) as e:
+                self.pop_error("Plot cannot be drawn: " + str(e))
+                return
+            # reference is kept, Tk does not display images collected by Python
+            window.image = tk.PhotoImage(file=path)
+            canvas.delete("all")
+            canvas.create_image(0, 0, anchor=tk.NW, image=window.image)
+            canvas.resizescrollregion()
+        listbox.bind("<<ListboxSelect>>", selected)
+
+    # clusters of the last run not loaded by view_plugin.py (beyond the top N)
+    def showPendingClusters(self):
+        cid = clustertree.computation_id(self.out_dir)
+        pending = getattr(stored, "caver_pending", {}).get(cid, [])
+        if not pending:
+            self.pop_error("All clusters of the last run are loaded.")
+            return
+        window = tk.Toplevel(self.parent)
+        window.title("CAVER clusters not loaded - " + self.out_dir)
+        listbox = tk.Listbox(window, width=30, height=20, selectmode=tk.EXTENDED)
+        for path, name, color in pending:
+            listbox.insert(tk.END, name)
+        listbox.pack(fill=tk.BOTH, expand=1, padx=4, pady=4)
+
+        def load():
+            numbers = [str(clustertree.cluster_objects(cid, [pending[int(i)][1]]).popitem()[0])
+                       for i in listbox.curselection()]
+            if numbers:
+                cmd.do("caver_load_clusters " + "+".join(numbers) + ", " + cid)
+                # loaded objects are picked up by the next move of the threshold slider
+                self.treeObjects = {}
+            window.destroy()
+
+        def loadAll():
+            listbox.select_set(0, tk.END)
+            load()
+        tk.Button(window, text="Load selected", command=load).pack(side=LEFT, padx=4, pady=4)
+        tk.Button(window, text="Load all", command=loadAll).pack(side=LEFT, padx=4, pady=4)
+
     def loadFileContent(self, file):
         handler = open(file)
         lines = handler.readlines()
@@ -621,28 +970,7 @@ class AnBeKoM:
                 return False
 
     def initialize_out_dir(self):
-        dir = self.binlocation.getvalue()
-        if not os.path.exists(dir):
-            os.mkdir(dir)
-        dir = dir.replace("\\","/")
-        if (dir.endswith("/")):
-            dir = dir[:-1]
-        out_home = dir + "/caver_output/"
-        if not os.path.exists(out_home):
-            os.mkdir(out_home)
-
-        max = 0
-        ls = os.listdir(out_home)
-        for f in ls:
-            fn = os.path.basename(f)
-            if fn.isdigit():
-                i = int(fn)
-                if max < i:
-                    max = i
-
-        new_dir = out_home + str(max + 1)
-        self.CreateDirectory(new_dir)
-        self.out_dir = new_dir
+        self.out_home, self.out_dir = allocate_out_dir(self.binlocation.getvalue())
         print("Output will be stored in " + self.out_dir)
 
     def coordinatesNotSet(self):
@@ -673,7 +1001,15 @@ class AnBeKoM:
             #for line in lines:
             #  wresult += line
             #error_dialog = Pmw.MessageDialog(self.parent,title = 'Information', message_text = wresult,)
-        if result == defaults["compute_command"]:
+        if result == defaults["cancel_command"]:
+            if self.job is not None and self.job.running():
+                print("*** Cancelling CAVER computation ***")
+                self.job.cancel()
+        elif result == defaults["compute_command"]:
+
+            if self.job is not None and not self.job.done():
+                self.pop_error("CAVER computation is already running. Wait for it to finish or cancel it.")
+                return
 
             if self.coordinatesNotSet():
                 self.pop_error("Please specify starting point - e.g. by selecting atoms or residues and clicking at the button 'Convert to x, y, z'.")
@@ -682,55 +1018,28 @@ class AnBeKoM:
 
             self.showCrisscross()
 
-            #input
-            sel1index = self.listbox1.curselection()[0]
-            sel1text = self.listbox1.get(sel1index)
-
-
-            self.whichModelSelect = sel1text
-
-            #print('selected ' + self.whichModelSelect)
-            sel=cmd.get_model(self.whichModelSelect)
-
             self.initialize_out_dir()
 
             # create subdirectory for inputs
             outdirInputs = self.out_dir + "/" + self.inputsSubdir
             self.CreateDirectory(outdirInputs)
 
-            self.stdamString = "+".join(self.stdam_list)
-            # jen to zaskrtnute
-            generatedString = ""
-            for key in self.s:
-                if self.s[key].get() == 1:
-                # pak pouzit do vyberu:
-                    if key == self.AAKEY:
-                        generatedString = generatedString + "+" + self.stdamString
-                    else:
-                        generatedString = generatedString + "+" + key
-
-            generatedString = generatedString[1:]
-            #print("Checked: " + generatedString)
-
-            mmodel = cmd.get_model(self.whichModelSelect)
-            #print(self.whichModelSelect + " asize: " + str(len(mmodel.atom)))
-            #newmodel = Indexed()
-            #for matom in mmodel.atom:
-                #if generatedString.find(matom.resn) > -1:
-                    #print(matom.resn)
-                    #newmodel.atom.append(matom)
-
-
-            #cmd.load_model(newmodel,"tmpCaverModel")
-            #cmd.label("example","name")
-
-            input = "%s/%s.pdb" % (outdirInputs, self.whichModelSelect)
-            cmd.set('retain_order',1)
-            cmd.sort()
-            cmd.save(input, self.whichModelSelect) # to by ulozilo cely model whichModelSelect.
-            #cmd.save(input, "tmpCaverModel")
-
-            #cmd.delete("tmpCaverModel")
+            self.cropSphere = None
+            self.snapshots = None
+            previous = None
+            if self.reclusterVar.get() == 1:
+                previous = self.reclusterRun.getvalue().strip() or recluster.latest_run(self.out_home, self.out_dir)
+                if previous is None or not recluster.has_tunnels(previous):
+                    self.pop_error("No tunnels to re-cluster found in " + str(previous) + ". Compute the tunnels first or choose a directory caver_output/N of a finished run.")
+                    return
+                print("*** Re-clustering tunnels of " + previous + " ***")
+                recluster.link_inputs(previous, outdirInputs)
+            else:
+                try:
+                    self.exportStructure(outdirInputs)
+                except ValueError as e:
+                    self.pop_error("The structure cannot be saved for CAVER.\n\n" + str(e))
+                    return
 
             cesta = os.getcwd()
 
@@ -747,36 +1056,60 @@ class AnBeKoM:
             cfgTimestamp = time.strftime("%Y-%m-%d-%H-%M")
             cfgnew = outdirInputs + "/config_" + cfgTimestamp + ".txt"
             self.configSave(cfgnew, cfg)
+            if self.snapshots is not None:
+                # snapshots are already thinned by the export
+                update_config(cfgnew, cfgnew, {"first_frame": 1, "last_frame": self.snapshots, "time_sparsity": 1})
+            if self.lazyPlotsVar.get() == 1:
+                update_config(cfgnew, cfgnew, plots.LAZY_CHANGES)
+            if previous is not None:
+                if recluster.prepare(previous, self.out_dir, cfgnew):
+                    print("*** Tunnels and cluster tree are loaded, only clustering and visualization are computed ***")
+                else:
+                    print("*** Tunnels are loaded, cluster tree is recomputed (clustering parameters changed) ***")
+
+            # results of re-clustering depend on the previous run, which is not part of the key
+            self.cache = None
+            if self.useCacheVar.get() == 1 and previous is None:
+                self.cache = ResultCache(self.out_home, defaults["default_result_cache_mb"])
+                self.cacheKey = job_key(outdirInputs, cfgnew)
+                entry = self.cache.lookup(self.cacheKey)
+                if entry is not None:
+                    print("*** Identical computation found in " + entry["out_dir"] + ", CAVER is not executed ***")
+                    self.cache.restore(self.cacheKey, entry, self.out_dir)
+                    self.showResults()
+                    return
+
+            # parameters of later stages changed only, tunnels of an earlier run are loaded
+            if self.incrementalVar.get() == 1 and previous is None:
+                base = incremental.find_base(self.out_home, outdirInputs, cfgnew, self.out_dir)
+                if base is not None:
+                    previous, stage, changed = base
+                    load_tree = recluster.prepare(previous, self.out_dir, cfgnew)
+                    print("*** Incremental computation: " + incremental.describe(previous, changed, load_tree) + " ***")
 
             # set correct java options
             #javaOpts = JOPTS.replace("@", self.javaHeap.getvalue())
 
-            pj = PyJava(self.javaHeap.getvalue(), caverfolder, caverjar, outdirInputs, cfgnew, self.out_dir)
-            if pj.java_missing:
-                return
-
-            pj.run_caver()
-
-            if pj.insufficient_memory:
-                self.pop_error("Available memory (" + str(pj.xmx) + " MB) is not sufficient to analyze this structure. Try to allocate more memory. 64-bit operating system and Java are needed to get over 1200 MB. Using smaller 'Number of approximating balls' can also help, but at the cost of decreased accuracy of computation.")
-
-            self.printErrorMessages(self.out_dir)
-            prevDir = os.getcwd()
-            print(prevDir)
-
-            runview = "run " + self.out_dir + "/pymol/view_plugin.py"
-            print(runview)
-            cmd.do(runview)
-            # adjust gui to display warnings & group
-            self.egroup.pack(fill="x")
-
-            err = "%s/warnings.txt" % (self.out_dir)
-            if os.path.exists(err) and os.stat(err)[6] == 0:
-                self.aftercomp.config(text="Computation finished succesfully")
-                self.afterbutt.config(state=DISABLED)
+            log_file = self.out_dir + "/plugin_output.txt"
+            parts = 1
+            # tunnels of a trajectory are split into chunks only when they are computed
+            if self.snapshots is not None and previous is None:
+                parts = len(chunks.windows(self.snapshots, int(self.trajectoryChunks.getvalue())))
+            if parts > 1:
+                make_pyjava = lambda c, d: PyJava(self.javaHeap.getvalue(), caverfolder, caverjar, outdirInputs, c, d)
+                job = chunks.create(make_pyjava, cfgnew, self.out_dir, self.snapshots, parts, log_file,
+                                    self.retryOomVar.get() == 1)
+                if job is None:
+                    return
+                print("*** Trajectory is computed in %d parallel chunks ***" % parts)
+                pj = job.merge_pj
+                self.job = job.start()
             else:
-                self.aftercomp.config(text="Warnings detected during computation")
-                self.afterbutt.config(state=ACTIVE)
+                pj = PyJava(self.javaHeap.getvalue(), caverfolder, caverjar, outdirInputs, cfgnew, self.out_dir)
+                if pj.java_missing:
+                    return
+                self.job = pj.start_caver(log_file)
+            self.startedJob(pj)
 
             #pass
             #self.deleteTemporaryFiles()
@@ -796,6 +1129,242 @@ class AnBeKoM:
                 #CAVER_BINARY_LOCATION = self.out_dir
                 self.dialog.withdraw()
 
+    # saves the selected model to the inputs directory
+    def exportStructure(self, outdirInputs):
+        sel1index = self.listbox1.curselection()[0]
+        self.whichModelSelect = self.listbox1.get(sel1index)
+        atom_filter = self.atomFilter()
+        if self.cropVar.get() == 1:
+            center = (float(self.xlocvar.get()), float(self.ylocvar.get()), float(self.zlocvar.get()))
+            atom_filter.crop = (center, float(self.cropRadius.getvalue()))
+        if self.trajectoryVar.get() == 1:
+            self.snapshots, atoms, total = export.export_trajectory(self.whichModelSelect, outdirInputs,
+                                                                    int(self.trajectoryStep.getvalue()), atom_filter)
+        else:
+            atoms, total = export.export_structure(self.whichModelSelect, outdirInputs, atom_filter)
+        if atom_filter.crop is not None:
+            self.cropSphere = atom_filter.crop
+            self.cropAtoms = (atoms, total)
+
+    # the same residues as include_residue_names, so Java parses only atoms it uses
+    def atomFilter(self):
+        residues = []
+        for key in sorted(self.s.keys()):
+            if self.s[key].get() == 1:
+                if key == self.AAKEY:
+                    residues += self.stdam_list
+                else:
+                    residues.append(key)
+        # nothing checked means no include_residue_names restriction
+        return export.AtomFilter(residues or None, self.stripHydrogensVar.get() == 1,
+                                 self.stripWatersVar.get() == 1, self.stripAltlocsVar.get() == 1)
+
+    # cluster tree of the displayed run drives the threshold slider
+    def loadClusterTree(self, out_dir):
+        self.clusterTree = None
+        self.thresholdScale.config(state=DISABLED)
+        tree_file = clustertree.find_tree(out_dir)
+        cfg = recluster.run_config(out_dir)
+        cid = clustertree.computation_id(out_dir)
+        if tree_file is None or cfg is None or cid is None:
+            self.thresholdInfo.config(text="(cluster tree not available)")
+            return
+        tunnels = clustertree.output_tunnels(out_dir)
+        tree = clustertree.ClusterTree.load(tree_file, len(tunnels))
+        threshold = float(config_values(cfg).get("clustering_threshold", defaults["default_clustering_threshold"]))
+        self.treeLabels, self.treeMatched = clustertree.match_clusters(tree, threshold, tunnels)
+        if self.treeMatched is None:
+            # regrouping by a wrong match would recolor unrelated clusters
+            self.thresholdInfo.config(text="(tunnels cannot be matched to the cluster tree, e.g. grains of grain_size)")
+            return
+        self.treeThreshold = threshold
+        self.treeCid = cid
+        self.treeObjects = {}
+        self.treeGroups = {}
+        low, high = tree.range()
+        self.clusterTree = tree
+        self.thresholdScale.config(state=NORMAL, from_=0, to=max(threshold, high) * 1.05)
+        self.thresholdScale.set(threshold)
+        self.thresholdDragged(threshold)
+
+    def thresholdDragged(self, value):
+        if self.clusterTree is None:
+            return
+        threshold = float(value)
+        self.clusteringThreshold.setvalue("%g" % threshold)
+        groups, split = clustertree.regroup(self.clusterTree, self.treeLabels, self.treeMatched, threshold)
+        if not self.treeObjects:
+            # view_plugin.py may still be running when the tree is loaded
+            self.treeObjects = clustertree.cluster_objects(self.treeCid, cmd.get_names("objects"))
+        for name in self.treeGroups:
+            for member in self.treeGroups[name]:
+                cmd.ungroup(member)
+            cmd.delete(name)
+        self.treeGroups = {}
+        for i, group in enumerate(groups):
+            members = []
+            for cluster in group:
+                members += self.treeObjects.get(cluster, [])
+            # merged clusters take the color of the best one
+            for name in members:
+                cmd.color('caver' + str(min(group[0], 1000)), name)
+            if len(group) > 1 and members:
+                name = "%s_cl%03d" % (self.treeCid, i + 1)
+                cmd.group(name, " ".join(members))
+                self.treeGroups[name] = members
+        text = "%d clusters" % self.clusterTree.count(threshold)
+        if split:
+            text += ", %d shown clusters split (re-cluster to display)" % len(split)
+        self.thresholdInfo.config(text=text)
+
+    def startedJob(self, pj):
+        self.pj = pj
+        self.setJobButtons(True)
+        self.egroup.pack(fill="x")
+        self.aftercomp.config(text="Computation is running...")
+        self.afterbutt.config(state=DISABLED)
+        self.plotsbutt.config(state=DISABLED)
+        self.morebutt.config(state=DISABLED)
+        self.watchJob()
+
+    # continues an interrupted run in its directory from the last completed stage
+    def resumeRun(self):
+        if self.job is not None and not self.job.done():
+            self.pop_error("CAVER computation is already running. Wait for it to finish or cancel it.")
+            return
+        out_home = os.path.join(self.binlocation.getvalue(), "caver_output")
+        run = self.reclusterRun.getvalue().strip()
+        stages = []
+        if run:
+            stages = checkpoint.completed(run)
+        if not stages or checkpoint.COMPLETE in stages:
+            # the field holds a finished run chosen for re-clustering
+            run = checkpoint.latest_interrupted(out_home)
+            stages = []
+            if run is not None:
+                stages = checkpoint.completed(run)
+        cfg = None
+        if stages:
+            cfg = recluster.run_config(run)
+        if cfg is None or checkpoint.COMPLETE in stages:
+            self.pop_error("No interrupted computation with completed stages found in " + str(run) + ".")
+            return
+        print("*** Resuming " + run + " after stages: " + ", ".join(stages) + " ***")
+        self.out_home = out_home
+        self.out_dir = run
+        self.cache = None
+        self.cropSphere = None
+        log_file = os.path.join(run, "plugin_output.txt")
+        if os.path.exists(log_file):
+            shutil.copy(log_file, os.path.join(run, "plugin_output_interrupted.txt"))
+        caverfolder = self.caver3locationAbsolute
+        pj = PyJava(self.javaHeap.getvalue(), caverfolder, caverfolder + "/caver.jar", os.path.join(run, self.inputsSubdir),
+                    checkpoint.resume_config(run, cfg), run)
+        if pj.java_missing:
+            return
+        self.job = pj.start_caver(log_file)
+        self.startedJob(pj)
+
+    def setJobButtons(self, running):
+        buttons = self.dialog.component('buttonbox')
+        buttons.button(defaults["cancel_command"]).config(state=NORMAL if running else DISABLED)
+        buttons.button(defaults["compute_command"]).config(state=DISABLED if running else NORMAL)
+
+    # called periodically from the Tk main loop while Java is running
+    def watchJob(self):
+        job = self.job
+        for line in job.read_lines():
+            print(line)
+        if job.waiting():
+            self.aftercomp.config(text="Waiting for free memory and cores...")
+            self.parent.after(100, self.watchJob)
+            return
+        if not job.done():
+            self.aftercomp.config(text="Computation is running... (%d s)" % job.elapsed())
+            self.parent.after(100, self.watchJob)
+            return
+        self.setJobButtons(False)
+        self.computationFinished(self.pj, job)
+
+    def computationFinished(self, pj, job):
+        if isinstance(job.error, chunks.ChunkFailure):
+            self.pop_error("Trajectory chunk failed, tunnels were not clustered\n\n" + str(job.error))
+            self.aftercomp.config(text="Computation failed")
+            return
+        if job.error is not None:
+            self.pop_error("Can't execute " + str(pj.cmd) + "\n\n" + str(job.error))
+            self.aftercomp.config(text="Computation failed")
+            return
+        if job.cancelled:
+            print("*** CAVER computation cancelled after %.1f s ***" % job.elapsed())
+            self.aftercomp.config(text="Computation cancelled")
+            self.reportStages()
+            return
+        print("*** CAVER computation finished in %.1f s ***" % job.elapsed())
+
+        if pj.insufficient_memory and self.retryOomVar.get() == 1 and pj.retry_after_oom():
+            self.job = pj.start_caver(self.out_dir + "/plugin_output.txt")
+            self.setJobButtons(True)
+            self.aftercomp.config(text="Out of memory, computation is repeated (attempt %d)..." % pj.attempt)
+            self.watchJob()
+            return
+        if pj.attempt > 1:
+            print("*** Attempts are recorded in " + os.path.join(self.out_dir, recovery.RECOVERY_LOG) + " ***")
+
+        if job.returncode != 0:
+            self.reportStages()
+        if pj.insufficient_memory:
+            self.pop_error("Available memory (" + str(pj.xmx) + " MB) is not sufficient to analyze this structure. Try to allocate more memory. 64-bit operating system and Java are needed to get over 1200 MB. Using smaller 'Number of approximating balls' can also help, but at the cost of decreased accuracy of computation.")
+        elif job.returncode == 0 and self.cache is not None and not pj.degraded():
+            self.cache.store(self.cacheKey, self.out_dir, skip=("inputs", chunks.CHUNKS_SUBDIR))
+
+        self.showResults()
+
+    def reportStages(self):
+        stages = checkpoint.completed(self.out_dir)
+        if stages and checkpoint.COMPLETE not in stages:
+            print("*** Completed stages: " + ", ".join(stages) + ", use 'Resume interrupted' to continue ***")
+
+    def reportCropBoundary(self):
+        center, radius = self.cropSphere
+        flagged = crop.boundary_clusters(self.out_dir, center, radius)
+        crop.record(self.out_dir, center, radius, self.cropAtoms[0], self.cropAtoms[1], flagged)
+        if flagged:
+            print("Warning: tunnels of %d clusters reach the crop boundary (%.1f A), they may be artifacts of cropping: %s" % (
+                len(flagged), radius, ", ".join(flagged)))
+            print("See " + os.path.join(self.out_dir, crop.CROP_LOG) + ", increase the crop radius to verify them.")
+
+    def showResults(self):
+        self.printErrorMessages(self.out_dir)
+        if self.cropSphere is not None:
+            self.reportCropBoundary()
+        prevDir = os.getcwd()
+        print(prevDir)
+
+        # clusters after the top N are loaded on demand (More clusters)
+        stored.caver_top_n = int(self.topClusters.getvalue() or 0)
+        runview = "run " + self.out_dir + "/pymol/view_plugin.py"
+        print(runview)
+        cmd.do(runview)
+        try:
+            self.loadClusterTree(self.out_dir)
+        except (IOError, OSError, ValueError, KeyError, IndexError) as e:
+            print("Warning: cluster tree cannot be loaded: " + str(e))
+            self.clusterTree = None
+            self.thresholdScale.config(state=DISABLED)
+        # adjust gui to display warnings & group
+        self.egroup.pack(fill="x")
+        self.plotsbutt.config(state=NORMAL if plots.has_sources(self.out_dir) else DISABLED)
+        self.morebutt.config(state=NORMAL)
+
+        err = "%s/warnings.txt" % (self.out_dir)
+        if os.path.exists(err) and os.stat(err)[6] == 0:
+            self.aftercomp.config(text="Computation finished succesfully")
+            self.afterbutt.config(state=DISABLED)
+        else:
+            self.aftercomp.config(text="Warnings detected during computation")
+            self.afterbutt.config(state=ACTIVE)
+
     def CreateDirectory(self,dir):
         if os.path.isdir(dir):
             return
@@ -842,6 +1411,13 @@ class AnBeKoM:
         self.conflocation.config(text=filepath)
         self.configLoad(self.getConfLoc())
         self.configJustLoaded = 1
+    # empty directory means the latest run with tunnels
+    def reclusterChoose(self):
+        indi = os.path.join(self.binlocation.getvalue(), "caver_output")
+        dirpath = filedialog.askdirectory(title="Previous run (caver_output/N)", initialdir=indi)
+        if not dirpath: return
+        self.reclusterRun.setvalue(dirpath)
+        self.reclusterVar.set(1)
     def configout(self):
         indi = os.path.dirname(self.getConfLoc())
         filepath = filedialog.asksaveasfilename(title="Save config file", initialdir=indi,filetypes=[("config txt file","*.txt"), ("all files","*.*")], defaultextension='.txt')
@@ -1217,50 +1793,44 @@ class AnBeKoM:
         return name
 
     def compute_center(self,selection="(all)"):
+        import numpy
         if not selection in cmd.get_names("selections") and not selection in cmd.get_names("objects"):
             self.pop_error("Selection '" + selection + "' does not exist, using all atoms.")
             selection = "all"
         object = self.getObjectName(selection)
         if None == object:
             return None
-        Ts = []
-        residues = self.getResids(selection) # SET1
-        atoms = self.getAtoms(selection)     # SET2
-        for r in residues:
-            r_sel = 'resi ' + str(r[0]) + ' and chain ' + r[1] + ' and object ' + object
-            residue_atoms = self.getAtoms(r_sel)
-            all = []
-            for a in residue_atoms:
-                if a in atoms:
-                    all = all + [a]
-            if len(all) == len(residue_atoms):
-                Ts = Ts + [self.computecenterRA(r_sel)]
-            else:
-                for a in all:
-                    Ts = Ts + [self.computecenterRA('id ' + str(a)  + ' and object ' + object)]
-
-        print('Centers: %s' % ', '.join(map(str, Ts)))
-        #print('Centers: ' + Ts)
-        sumx = 0
-        sumy = 0
-        sumz = 0
-        if len(Ts) == 0:
+        # whole residues of the selection in one pass over state 1
+        stored.caver_atoms = []
+        cmd.iterate_state(1, "(byres (" + selection + ")) and object " + object,
+                          "stored.caver_atoms.append((resi, chain, ID, x, y, z))")
+        if len(stored.caver_atoms) == 0:
             return (0, 0, 0)
+        keys = numpy.array([a[1] + "/" + a[0] for a in stored.caver_atoms])
+        ids = numpy.array([a[2] for a in stored.caver_atoms])
+        xyz = numpy.array([a[3:] for a in stored.caver_atoms], dtype=float)
+        stored.caver_atoms = []
+        selected = numpy.isin(ids, numpy.array(list(self.getAtoms(selection))))
+        residues, residue_of = numpy.unique(keys, return_inverse=True)
+        total = numpy.bincount(residue_of, minlength=len(residues))
+        chosen = numpy.bincount(residue_of, weights=selected, minlength=len(residues))
+        whole = chosen == total
+        # residues fully in the selection are represented by their centroids,
+        # the others by their selected atoms
+        sums = numpy.zeros((len(residues), 3))
+        for i in range(3):
+            sums[:, i] = numpy.bincount(residue_of, weights=xyz[:, i], minlength=len(residues))
+        centroids = sums[whole] / total[whole][:, None]
+        points = xyz[selected & ~whole[residue_of]]
+        Ts = numpy.vstack([centroids, points])
+
+        print('Centers: %s' % ', '.join(['(%s, %s, %s)' % tuple(t) for t in Ts.tolist()]))
         l = len(Ts)
-        for center in Ts:
-            sumx += center[0]
-            sumy += center[1]
-            sumz += center[2]
+        if l == 0:
+            return (0, 0, 0)
+        sumx, sumy, sumz = Ts.sum(axis=0).tolist()
         print('Starting point: ' + str(sumx) + " " + str(sumy) + " " + str(sumz) + " " + str(l))
         return (sumx/l, sumy/l, sumz/l)
-        # Ts = []
-        # detect all residues in selection => SET1
-        # detect all atoms in selection => SET2
-        # foreach residue, detect all its atoms
-        #    if all atoms are in SET2, attach computeCenter(S1) to Ts
-        #    if at least one atom is not in SET1, traverse these atoms again and !only! those in SET2 add to Ts
-        # computeCenter(Ts)
-        # return
 
     # compute center for given selection
     def computecenterRA(self,selection="(all)"):
@@ -0,0 +1,197 @@
+#
+# Headless batch computation of tunnels in many structures
+#
+# usage: python -m Caver3.batch -c config.txt -o out_dir [--heap MB] [--jobs N] structures...
+#
+# Each structure (PDB file, or all PDB files of a given directory) is computed
+# in its own output directory out_dir/<structure name>, the runs are executed
+# in a process pool and summarized in out_dir/batch_summary.csv. Java launches
+# of all workers share one memory and CPU budget (see scheduler.py).
+#
+
+import argparse
+import csv
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing.managers import BaseManager
+
+from . import PyJava, CAVER3_LOCATION, defaults
+from . import jvm
+from .scheduler import ResourceBudget
+
+STRUCTURE_SUFFIXES = (".pdb", ".ent")
+
+SUMMARY_COLUMNS = ["structure", "status", "seconds", "xmx", "attempts", "clusters", "tunnels", "out_dir", "messages"]
+
+
+class BudgetManager(BaseManager):
+    pass
+
+BudgetManager.register("ResourceBudget", ResourceBudget)
+
+
+def find_structures(paths):
+    structures = []
+    for path in paths:
+        if os.path.isdir(path):
+            for fn in sorted(os.listdir(path)):
+                if fn.lower().endswith(STRUCTURE_SUFFIXES):
+                    structures.append(os.path.join(path, fn))
+        else:
+            structures.append(path)
+    return structures
+
+
+# one directory per structure, named after the structure
+def allocate_dirs(structures, out_root):
+    dirs = []
+    used = set()
+    for structure in structures:
+        stem = os.path.splitext(os.path.basename(structure))[0]
+        name = stem
+        i = 1
+        while name in used or os.path.exists(os.path.join(out_root, name)):
+            i += 1
+            name = "%s_%d" % (stem, i)
+        used.add(name)
+        dirs.append(os.path.join(out_root, name))
+    return dirs
+
+
+def count_tunnels(out_dir):
+    path = os.path.join(out_dir, "analysis", "tunnel_characteristics.csv")
+    if not os.path.isfile(path):
+        return 0, 0
+    clusters = set()
+    tunnels = 0
+    with open(path) as handler:
+        for row in csv.DictReader(handler, skipinitialspace=True):
+            row = dict([(k.strip(), v) for k, v in row.items() if k is not None])
+            tunnels += 1
+            clusters.add(row.get("Tunnel cluster"))
+    return len(clusters), tunnels
+
+
+def read_messages(out_dir):
+    path = os.path.join(out_dir, "messages.txt")
+    if not os.path.isfile(path):
+        return ""
+    with open(path) as handler:
+        return " ".join(handler.read().split())
+
+
+def run_structure(task):
+    structure, out_dir, config, heap, budget, retry = task
+    inputs = os.path.join(out_dir, "inputs")
+    os.makedirs(inputs)
+    shutil.copy(structure, inputs)
+    cfg = os.path.join(inputs, "config.txt")
+    shutil.copy(config, cfg)
+
+    result = dict([(c, "") for c in SUMMARY_COLUMNS])
+    result["structure"] = structure
+    result["out_dir"] = out_dir
+    start = time.time()
+    stdout = sys.stdout
+    log = open(os.path.join(out_dir, "batch_log.txt"), 'w')
+    sys.stdout = log
+    try:
+        PyJava.interactive = False
+        PyJava.budget = budget
+        pj = PyJava(heap, CAVER3_LOCATION, os.path.join(CAVER3_LOCATION, "caver.jar"), inputs, cfg, out_dir)
+        if pj.java_missing:
+            result["status"] = "java missing"
+        else:
+            log_file = os.path.join(out_dir, "plugin_output.txt")
+            code = pj.start_caver(log_file, queued=False).wait()
+            while pj.insufficient_memory and retry and pj.retry_after_oom():
+                code = pj.start_caver(log_file, queued=False).wait()
+            result["xmx"] = pj.xmx
+            result["attempts"] = pj.attempt
+            if pj.insufficient_memory:
+                result["status"] = "out of memory"
+            elif code != 0:
+                result["status"] = "failed (%s)" % code
+            elif pj.degraded():
+                result["status"] = "ok (degraded)"
+            else:
+                result["status"] = "ok"
+    except Exception as e:
+        result["status"] = "error: %s" % e
+    finally:
+        sys.stdout = stdout
+        log.close()
+    result["seconds"] = "%.1f" % (time.time() - start)
+    result["clusters"], result["tunnels"] = count_tunnels(out_dir)
+    result["messages"] = read_messages(out_dir)
+    return result
+
+
+def write_summary(results, path):
+    with open(path, 'w') as handler:
+        writer = csv.DictWriter(handler, fieldnames=SUMMARY_COLUMNS)
+        writer.writeheader()
+        for r in results:
+            writer.writerow(r)
+
+
+def print_summary(results):
+    print("%-30s %-16s %9s %7s %8s %8s %8s" % ("structure", "status", "seconds", "xmx", "attempts", "clusters", "tunnels"))
+    for r in results:
+        print("%-30s %-16s %9s %7s %8s %8s %8s" % (os.path.basename(r["structure"]), r["status"],
+                                                     r["seconds"], r["xmx"], r["attempts"], r["clusters"], r["tunnels"]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m Caver3.batch",
+                                     description="Compute tunnels by CAVER in many structures without PyMOL GUI.")
+    parser.add_argument("structures", nargs="+", help="PDB files or directories with PDB files")
+    parser.add_argument("-c", "--config", required=True, help="CAVER configuration (must define the starting point)")
+    parser.add_argument("-o", "--out", required=True, help="directory for results")
+    parser.add_argument("--heap", type=int, default=int(defaults["default_java_heap"]), help="maximum Java heap per job (MB)")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="number of worker processes (default: number of cores)")
+    parser.add_argument("--memory", type=int, default=None, help="memory for all concurrent Java processes (MB, default: 80%% of physical memory)")
+    parser.add_argument("--cpus", type=int, default=None, help="cores for all concurrent Java processes")
+    parser.add_argument("--no-retry", action="store_true", help="do not repeat computations which ran out of memory")
+    parser.add_argument("--pin", action="store_true", help="pin each Java process to its reserved cores")
+    args = parser.parse_args(argv)
+
+    structures = find_structures(args.structures)
+    if not structures:
+        parser.error("no structures found")
+    if not os.path.isdir(args.out):
+        os.makedirs(args.out)
+    jobs = args.jobs or jvm.available_cores()
+
+    # probe heap and build the CDS archive once, workers then find them cached
+    PyJava.interactive = False
+    probe = PyJava(args.heap, CAVER3_LOCATION, os.path.join(CAVER3_LOCATION, "caver.jar"))
+    if probe.java_missing:
+        return 1
+
+    manager = BudgetManager()
+    manager.start()
+    budget = manager.ResourceBudget(args.memory, args.cpus, args.pin)
+    print("*** Computing %d structures in %d processes (heap up to %d MB per job, budget %s) ***" % (len(structures), jobs, probe.xmx, budget.usage()))
+    tasks = [(s, d, args.config, args.heap, budget, not args.no_retry) for s, d in zip(structures, allocate_dirs(structures, args.out))]
+    results = []
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(run_structure, t) for t in tasks]
+        for future in as_completed(futures):
+            r = future.result()
+            print("%s: %s in %s s" % (r["structure"], r["status"], r["seconds"]))
+            results.append(r)
+    manager.shutdown()
+    results.sort(key=lambda r: r["structure"])
+    summary = os.path.join(args.out, "batch_summary.csv")
+    write_summary(results, summary)
+    print_summary(results)
+    print("Summary written to " + summary)
+    return 0 if all([r["status"].startswith("ok") for r in results]) else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
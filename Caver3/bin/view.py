@@ -2,6 +2,9 @@ from pymol import cmd
 from chempy.models import Indexed
 from chempy import Bond, Atom
 from pymol import cmd
+from array import array
+from collections import OrderedDict
+import threading
 
 if not os.path.exists("../data/clusters"):
 	cmd.cd("$pymol_scripts")
@@ -9,20 +12,15 @@ if not os.path.exists("../data/clusters"):
 filename = './modules/rgb.py'
 exec(compile(open(filename, "rb").read(), filename, 'exec'))
 
-def create_bond(model, a1, a2): # one-based atom serial numbers
-	b = Bond()
-	b.index = [a1 - 1, a2 - 1] # zero-based indices!
-	model.bond.append(b)
-
-def create_spheres(name, spheres, links, frame):
-
-	cmd.delete(name)
+# atoms with radius 0.5 are not displayed, bonds are remapped to the kept atoms
+def sphere_model(name, spheres, links):
 	model = Indexed()
-	for i in (range(len(spheres) / 4)):
+	cluster = int(name[7:10])
+	kept = {}  # one-based serial number -> zero-based index in model
+	for i in range(len(spheres) // 4):
 		ai = i * 4
-		r = spheres[ai + 3]
-		cluster = int(name[7:10])
-		if r <> 0.5:
+		if spheres[ai + 3] != 0.5:
+			kept[i + 1] = len(model.atom)
 			a=Atom()
 			a.name = "X" + str(i)
 			a.resi = str(cluster)
@@ -30,53 +28,187 @@ def create_spheres(name, spheres, links, frame):
 			a.coord = [spheres[ai], spheres[ai + 1], spheres[ai + 2]]
 			model.atom.append(a)
 
-	for i in (range(len(links) / 2)):
+	for i in range(len(links) // 2):
 		li = i * 2
-		a1 = links[li]
-		a2 = links[li + 1]
-		create_bond(model, a1, a2)
+		if links[li] in kept and links[li + 1] in kept:
+			b = Bond()
+			b.index = [kept[links[li]], kept[links[li + 1]]]
+			model.bond.append(b)
+	return model
 
-	cmd.load_model(model, name,frame)
+def create_spheres(name, spheres, links, frame):
+
+	cmd.delete(name)
+	cmd.load_model(sphere_model(name, spheres, links), name,frame)
 	cmd.hide("lines", name)
 	cmd.show("spheres", name)
 
+def parse_model(infile, spheres, links):
+	for line in infile:
+		if(line[0:4] == b"ATOM"):
+			spheres.append(float(line[30:38]))
+			spheres.append(float(line[38:46]))
+			spheres.append(float(line[46:54]))
+			spheres.append(float(line[62:66]))
+		elif(line[0:6] == b"CONECT"):
+			links.append(int(line[6:11]))
+			links.append(int(line[11:16]))
+		elif(line[0:6] == b"ENDMDL"):
+			break
+
+# byte offsets of MODEL records of each cluster file, kept in ../data/clusters_index
+# and rebuilt when the cluster file changes (mtime and size are stored in the first line)
+indexDir = "../data/clusters_index"
+frameIndexes = {}
+
+def buildFrameIndex(path):
+	offsets = []
+	offset = 0
+	infile = open(path, "rb")
+	for line in infile:
+		if line[0:5] == b"MODEL":
+			offsets.append(offset)
+		offset += len(line)
+	infile.close()
+	return offsets
+
+def frameIndex(tunnelName):
+	path = "../data/clusters/" + tunnelName
+	st = os.stat(path)
+	stamp = "%d %d" % (int(st.st_mtime), st.st_size)
+	cached = frameIndexes.get(tunnelName)
+	if cached is not None and cached[0] == stamp:
+		return cached[1]
+	indexPath = os.path.join(indexDir, tunnelName + ".idx")
+	offsets = None
+	if os.path.exists(indexPath):
+		f = open(indexPath, "r")
+		if f.readline().strip() == stamp:
+			offsets = [int(x) for x in f.read().split()]
+		f.close()
+	if offsets is None:
+		offsets = buildFrameIndex(path)
+		try:
+			if not os.path.isdir(indexDir):
+				os.makedirs(indexDir)
+			f = open(indexPath, "w")
+			f.write(stamp + "\n")
+			f.write("\n".join([str(x) for x in offsets]))
+			f.close()
+		except (IOError, OSError):
+			pass  # read-only output, the index is kept in memory only
+	frameIndexes[tunnelName] = (stamp, offsets)
+	return offsets
+
+# parsed frames of the per-frame path, least recently used ones are dropped over
+# frameCacheBytes, next prefetchFrames frames in the direction of playback are
+# read in background; caver_frame_cache prints the counters or changes the limits
+frameCache = OrderedDict()
+frameCacheBytes = 256 * 1024 * 1024
+frameCacheUsed = [0]
+frameCacheStats = {"hits": 0, "misses": 0, "prefetched": 0, "evicted": 0}
+frameCacheLock = threading.Lock()
+indexLock = threading.Lock()
+prefetchFrames = 10
+prefetchRequest = [None]
+prefetchEvent = threading.Event()
+lastFrame = [0]
+stateCount = [0]
+
+def readFrame(tunnelName, frame):
+	spheres = array("d")
+	links = array("i")
+	indexLock.acquire()
+	try:
+		offsets = frameIndex(tunnelName)
+	finally:
+		indexLock.release()
+	if frame <= len(offsets):
+		infile = open("../data/clusters/" + tunnelName, "rb")
+		infile.seek(offsets[frame - 1])  # MODEL line of actual frame
+		infile.readline()
+		parse_model(infile, spheres, links)
+		infile.close()
+	return spheres, links
+
+def storeFrame(key, value):
+	size = value[0].itemsize * len(value[0]) + value[1].itemsize * len(value[1]) + 200
+	frameCacheLock.acquire()
+	try:
+		if key not in frameCache:
+			frameCache[key] = (value, size)
+			frameCacheUsed[0] += size
+		trimFrameCache()
+	finally:
+		frameCacheLock.release()
+
+def trimFrameCache():  # called with frameCacheLock held
+	while frameCacheUsed[0] > frameCacheBytes and len(frameCache) > 1:
+		frameCacheUsed[0] -= frameCache.popitem(last=False)[1][1]
+		frameCacheStats["evicted"] += 1
+
+def cachedFrame(tunnelName, frame):
+	key = (tunnelName, frame)
+	frameCacheLock.acquire()
+	try:
+		entry = frameCache.pop(key, None)
+		if entry is not None:
+			frameCache[key] = entry  # most recently used
+			frameCacheStats["hits"] += 1
+			return entry[0]
+		frameCacheStats["misses"] += 1
+	finally:
+		frameCacheLock.release()
+	value = readFrame(tunnelName, frame)
+	storeFrame(key, value)
+	return value
+
+def prefetchLoop():
+	while True:
+		prefetchEvent.wait()
+		prefetchEvent.clear()
+		frame, step = prefetchRequest[0]
+		for i in range(1, prefetchFrames + 1):
+			f = frame + i * step
+			if f < 1 or f > stateCount[0] or prefetchEvent.is_set():
+				break  # out of the trajectory or the user moved elsewhere
+			for tn in tunnelNames:
+				if (tn, f) not in frameCache:
+					storeFrame((tn, f), readFrame(tn, f))
+					frameCacheStats["prefetched"] += 1
+
+def caver_frame_cache(limit_mb=None, prefetch=None):
+	global frameCacheBytes, prefetchFrames
+	if limit_mb is not None:
+		frameCacheBytes = int(float(limit_mb) * 1024 * 1024)
+		frameCacheLock.acquire()
+		trimFrameCache()
+		frameCacheLock.release()
+	if prefetch is not None:
+		prefetchFrames = int(prefetch)
+	hits = frameCacheStats["hits"]
+	total = hits + frameCacheStats["misses"]
+	print("CAVER frame cache: %d frames, %.1f of %.1f MB, hit rate %.1f %% (%d of %d), %d prefetched, %d evicted, prefetch %d frames" % (
+		len(frameCache), frameCacheUsed[0] / 1048576.0, frameCacheBytes / 1048576.0,
+		100.0 * hits / total if total else 0.0, hits, total,
+		frameCacheStats["prefetched"], frameCacheStats["evicted"], prefetchFrames))
+
+cmd.extend("caver_frame_cache", caver_frame_cache)
+
 def computeSpheres(frame):
 	#starttime = time.time();
 	tunnels = {}
 	conects = {}
 
 	for tunnelName in tunnelNames:  # for each cluster
-		path = "../data/clusters/" + tunnelName
-		infile = open(path, "r")    # open PDB file with cluster
-		modelNumber = 0;
-		spheres = []
-		links = []
-		unfinished = True
-		while infile and unfinished:
-			line = infile.readline()
-
-			if(len(line) == 0):
-				break
-
-			if(line[0:5] == "MODEL"):
-				modelNumber += 1;
-
-				if(modelNumber == frame): # find line for actual frame
-					while infile and unfinished:
-						line = infile.readline()
-						if(line[0:4] == "ATOM"):
-							spheres.append(float(line[30:38]))
-							spheres.append(float(line[38:46]))
-							spheres.append(float(line[46:54]))
-							spheres.append(float(line[62:66]))
-						if(line[0:6] == "CONECT"):
-							links.append(int(line[6:11]))
-							links.append(int(line[11:16]))
-						if(line[0:6] == "ENDMDL"):
-						 	tunnels[tunnelName] = spheres
-							conects[tunnelName] = links
-						 	unfinished = False
-		infile.close()
+		tunnels[tunnelName], conects[tunnelName] = cachedFrame(tunnelName, frame)
+
+	step = 1
+	if frame < lastFrame[0]:
+		step = -1
+	lastFrame[0] = frame
+	prefetchRequest[0] = (frame, step)
+	prefetchEvent.set()
 
 	color = 1
 	view = cmd.get_view()
@@ -91,6 +223,35 @@ def computeSpheres(frame):
 	#endtime = time.time();
 	#print str(endtime - starttime)
 
+# trajectories up to this size (all cluster files) are loaded at once as states
+# of one object per cluster, larger ones are rebuilt for each displayed frame
+maxPreloadBytes = 300 * 1024 * 1024
+
+def loadStates():
+	color = 1
+	view = cmd.get_view()
+	for tn in tunnelNames:  # for each cluster
+		cmd.delete(tn)
+		infile = open("../data/clusters/" + tn, "rb")
+		frame = 0
+		for line in infile:
+			if(line[0:5] == b"MODEL"):
+				frame += 1
+				spheres = []
+				links = []
+				parse_model(infile, spheres, links)
+				if spheres:
+					cmd.load_model(sphere_model(tn, spheres, links), tn, frame, discrete=1, zoom=0)
+		infile.close()
+		cmd.hide("lines", tn)
+		cmd.show("spheres", tn)
+		sc = 'caver' + str(color)
+		cmd.color(color, tn)
+		cmd.color(sc, tn)
+		if color < 1000:
+			color += 1
+	cmd.set_view(view)
+
 
 
 if not os.path.exists("../data/clusters"):
@@ -132,6 +293,14 @@ cmd.show('cartoon', 'structure')
 cmd.color('gray', 'structure')
 
 cmd.mset("1 -%d" % cmd.count_states())
-for frame in range(1,cmd.count_states()+1):
-	cmd.mdo(frame, "computeSpheres(" + str(frame) + ")")
+clusterBytes = sum([os.path.getsize("../data/clusters/" + tn) for tn in tunnelNames])
+if clusterBytes <= maxPreloadBytes:
+	loadStates()
+else:
+	stateCount[0] = cmd.count_states()
+	prefetcher = threading.Thread(target=prefetchLoop)
+	prefetcher.daemon = True
+	prefetcher.start()
+	for frame in range(1,cmd.count_states()+1):
+		cmd.mdo(frame, "computeSpheres(" + str(frame) + ")")
 cmd.frame(1)
@@ -1,4 +1,6 @@
-from pymol import cmd
+from pymol import cmd, stored
+from multiprocessing.pool import ThreadPool
+import re
 
 def parrent(dir):
   return os.path.abspath(os.path.join(dir, os.path.pardir))
@@ -7,15 +9,90 @@ scripts = '$pymol_scripts' + '/'
 home = parrent(scripts) + '/'
 
 def exists(name):
-	for n in cmd.get_names("all"):
-		if n == name:
-			return True
+	return name in cmd.get_names("all")
 
 def load_safely(file, name):
 	if exists(name):
 		cmd.delete(name)
 	cmd.load(file, name)
 
+def read_file(path):
+	f = open(path, "r")
+	content = f.read()
+	f.close()
+	return content
+
+# (file, object name, color) of the clusters in the order of their priority
+def cluster_files(cluster_dir, id):
+	files = []
+	color = 1
+	for fn in sorted(os.listdir(cluster_dir)):
+		name = id + '_' + fn.replace('tun_cl_','t')
+		suffix = name[-4:]
+		if '.pdb' == suffix or '.ent' == suffix:
+			name = name[:-4]
+		files.append((os.path.join(cluster_dir, fn), name, 'caver' + str(color)))
+		if color < 1000:
+			color += 1
+	return files
+
+# files are read in parallel, objects are then created from the contents and
+# styled by a few calls covering all of them at once
+def load_clusters(files):
+	if not files:
+		return
+	pool = ThreadPool(8)
+	contents = pool.map(read_file, [path for path, name, color in files])
+	pool.close()
+	existing = set(cmd.get_names("all"))
+	colors = {}
+	for (path, name, color), content in zip(files, contents):
+		if name in existing:
+			cmd.delete(name)
+		cmd.read_pdbstr(content, name)
+		colors[name] = cmd.get_color_index(color)
+	clusters = " or ".join(colors)
+	cmd.alter(clusters, 'vdw=b')
+	cmd.hide('everything', clusters)
+	cmd.show('spheres', clusters)
+	cmd.alter(clusters, 'color=colors[model]', space={'colors': colors})
+	cmd.recolor()
+
+# clusters after the top stored.caver_top_n (0 loads all) are only listed in
+# stored.caver_pending until they are loaded by caver_load_clusters
+if not hasattr(stored, 'caver_pending'):
+	stored.caver_pending = {}
+
+def cluster_number(name):
+	return int(re.search(r'_t(\d+)_', name).group(1))
+
+# clusters is "all", a number, a range (11-20) or numbers joined by +
+def caver_load_clusters(clusters='all', id=None):
+	if id is None:
+		id = stored.caver_last_id
+	wanted = set()
+	for part in str(clusters).split('+'):
+		if '-' in part:
+			first, last = part.split('-')
+			wanted.update(range(int(first), int(last) + 1))
+		elif part.strip() != 'all':
+			wanted.add(int(part))
+	pending = stored.caver_pending.get(id, [])
+	chosen = [f for f in pending if not wanted or cluster_number(f[1]) in wanted]
+	stored.caver_pending[id] = [f for f in pending if f not in chosen]
+	view = cmd.get_view()
+	load_clusters(chosen)
+	cmd.set_view(view)
+	print("CAVER: loaded %d clusters, %d not loaded" % (len(chosen), len(stored.caver_pending[id])))
+
+def caver_list_clusters(id=None):
+	if id is None:
+		id = stored.caver_last_id
+	for path, name, color in stored.caver_pending.get(id, []):
+		print(name)
+
+cmd.extend('caver_load_clusters', caver_load_clusters)
+cmd.extend('caver_list_clusters', caver_list_clusters)
 
 view = cmd.get_view()
 
@@ -27,23 +104,17 @@ cmd.delete(id + '_v_origins')
 filename = scripts + '/modules/rgb.py'
 exec(compile(open(filename, "rb").read(), filename, 'exec'))
 
-color = 1
+stored.caver_last_id = id
+stored.caver_pending[id] = []
 cluster_dir = home + "data/clusters_timeless"
 if os.path.exists(cluster_dir):
-	list = os.listdir(cluster_dir)
-	list.sort()
-	for fn in list:
-		name = id + '_' + fn.replace('tun_cl_','t')
-		suffix = name[-4:]
-		if '.pdb' == suffix or '.ent' == suffix:
-			name = name[:-4]
-		load_safely(home + 'data/clusters_timeless/' + fn, name)
-		cmd.alter(name, 'vdw=b')
-		cmd.hide('everything', name)
-		cmd.show('spheres', name)
-		cmd.color('caver' + str(color), name)
-		if color < 1000:
-			color += 1
+	files = cluster_files(cluster_dir, id)
+	top_n = int(getattr(stored, 'caver_top_n', 0))
+	if top_n > 0 and len(files) > top_n:
+		stored.caver_pending[id] = files[top_n:]
+		files = files[:top_n]
+		print("CAVER: top %d clusters loaded, caver_list_clusters lists the other %d, caver_load_clusters loads them" % (top_n, len(stored.caver_pending[id])))
+	load_clusters(files)
 
 no = id + '_origins'
 nvo = id + '_v_origins'
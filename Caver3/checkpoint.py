@@ -0,0 +1,127 @@
+#
+# Stages of a CAVER computation completed in an output directory
+#
+# CAVER computes tunnels, builds the cluster tree and then writes the
+# outputs. The plugin watches the output of Java for the start of the next
+# stage and records finished stages in stages.txt, so an interrupted,
+# killed or crashed run can be resumed in the same directory with
+# load_tunnels and load_cluster_tree instead of being computed again.
+#
+
+import os
+import time
+
+from .configfile import update_config
+
+STAGE_FILE = "stages.txt"
+
+TUNNELS = "tunnels"
+CLUSTER_TREE = "cluster_tree"
+COMPLETE = "complete"
+
+# lines of CAVER output showing that a stage is finished
+MARKERS = [
+    (TUNNELS, ["Going to cluster", "Computing distance matrix", "Saving matrix of pairwise tunnel similarities",
+               "Performing average link hierarchical"]),
+    (CLUSTER_TREE, [" tunnels clustered into "]),
+]
+
+
+def tunnels_present(out_dir):
+    d = os.path.join(out_dir, "data", "tunnels")
+    return os.path.isdir(d) and len(os.listdir(d)) > 0
+
+
+def tree_present(out_dir):
+    for root, dirs, files in os.walk(os.path.join(out_dir, "data")):
+        if "tree.txt" in files:
+            return True
+    return False
+
+
+def recorded(out_dir):
+    path = os.path.join(out_dir, STAGE_FILE)
+    if not os.path.isfile(path):
+        return []
+    handler = open(path)
+    stages = [line.split()[0] for line in handler if line.strip()]
+    handler.close()
+    return stages
+
+
+# finished stages whose results are still present
+def completed(out_dir):
+    stages = recorded(out_dir)
+    result = []
+    if TUNNELS in stages and tunnels_present(out_dir):
+        result.append(TUNNELS)
+        if CLUSTER_TREE in stages and tree_present(out_dir):
+            result.append(CLUSTER_TREE)
+            if COMPLETE in stages:
+                result.append(COMPLETE)
+    return result
+
+
+# config options skipping the completed stages
+def resume_changes(stages):
+    return {"load_tunnels": "yes" if TUNNELS in stages else "no",
+            "load_cluster_tree": "yes" if CLUSTER_TREE in stages else "no"}
+
+
+class StageRecorder:
+    def __init__(self, out_dir):
+        self.out_dir = out_dir
+        self.stages = recorded(out_dir)
+
+    def mark(self, stage):
+        if stage in self.stages:
+            return
+        self.stages.append(stage)
+        try:
+            handler = open(os.path.join(self.out_dir, STAGE_FILE), 'a')
+            handler.write("%s %s\n" % (stage, time.strftime("%Y-%m-%d %H:%M:%S")))
+            handler.close()
+        except (IOError, OSError) as e:
+            print("Warning: cannot record stage " + stage + ": " + str(e))
+
+    # listener of the job output
+    def line(self, line):
+        for stage, markers in MARKERS:
+            if stage not in self.stages:
+                for marker in markers:
+                    if marker in line:
+                        self.mark(stage)
+                        break
+
+    # finish callback of the job
+    def finished(self, job):
+        if job.returncode == 0 and not job.cancelled:
+            # a run loading everything prints no markers
+            for stage, markers in MARKERS:
+                self.mark(stage)
+            self.mark(COMPLETE)
+
+
+# most recent run of out_home which was interrupted after some stage
+def latest_interrupted(out_home):
+    runs = []
+    if os.path.isdir(out_home):
+        for fn in os.listdir(out_home):
+            path = os.path.join(out_home, fn)
+            if fn.isdigit():
+                stages = completed(path)
+                if stages and COMPLETE not in stages:
+                    runs.append((int(fn), path))
+    if not runs:
+        return None
+    return max(runs)[1]
+
+
+# new config of run_dir loading its completed stages, based on the config it was computed with
+def resume_config(run_dir, cfg):
+    base, ext = os.path.splitext(cfg)
+    if "_resume" in base:
+        base = base[:base.rfind("_resume")]
+    resumed = base + "_resume" + ext
+    update_config(cfg, resumed, resume_changes(completed(run_dir)))
+    return resumed
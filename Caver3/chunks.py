@@ -0,0 +1,170 @@
+#
+# Parallel analysis of long trajectories in chunks of snapshots
+#
+# The snapshot range is split into first_frame/last_frame windows computed
+# by separate CAVER jobs (stop_after tunnels), which run concurrently within
+# the memory and CPU budget of the scheduler. Tunnels of all windows are
+# then linked into the output directory and one final job loads them
+# (load_tunnels) and clusters them together, so clusters are the same as
+# in a single run over the whole trajectory.
+#
+
+import os
+import threading
+import time
+
+from . import recovery
+from .configfile import update_config
+from .jobs import CaverJob
+from .resultcache import link_or_copy
+
+CHUNKS_SUBDIR = "chunks"
+
+# windows shorter than this are not worth a JVM of their own
+MIN_SNAPSHOTS = 10
+
+
+def windows(snapshots, chunks):
+    chunks = max(1, min(chunks, snapshots // MIN_SNAPSHOTS))
+    size = snapshots // chunks
+    extra = snapshots % chunks
+    result = []
+    first = 1
+    for i in range(chunks):
+        last = first + size - 1 + (1 if i < extra else 0)
+        result.append((first, last))
+        first = last + 1
+    return result
+
+
+def merge_tunnels(chunk_dirs, out_dir):
+    target = os.path.join(out_dir, "data", "tunnels")
+    if not os.path.isdir(target):
+        os.makedirs(target)
+    for d in chunk_dirs:
+        src = os.path.join(d, "data", "tunnels")
+        if not os.path.isdir(src):
+            raise IOError("no tunnels computed in " + d)
+        for fn in os.listdir(src):
+            dst = os.path.join(target, fn)
+            if os.path.exists(dst):
+                raise IOError("tunnel file " + fn + " computed by more chunks")
+            link_or_copy(os.path.join(src, fn), dst)
+
+
+# chunk which could not be computed, the merge job was not started
+class ChunkFailure(Exception):
+    pass
+
+
+# job running the chunks and the final clustering, it is watched like a CaverJob
+class ChunkedJob(CaverJob):
+    def __init__(self, chunk_pjs, merge_pj, log_file=None, retry=True):
+        CaverJob.__init__(self, None, log_file)
+        self.chunk_pjs = chunk_pjs
+        self.merge_pj = merge_pj
+        # chunks out of memory are repeated (see recovery.py)
+        self.retry = retry
+        self.jobs = []
+        self.lock = threading.Lock()
+
+    def start(self):
+        self.started = time.time()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def relay(self, prefix):
+        return lambda line: self.lines.put(prefix + line)
+
+    def launch(self, pj, prefix, log_file):
+        with self.lock:
+            if self.cancelled:
+                return None
+            job = pj.start_caver(log_file, queued=False, listeners=[self.relay(prefix)])
+            self.jobs.append(job)
+            return job
+
+    def run(self):
+        try:
+            self.returncode = self.run_chunks()
+        except Exception as e:
+            self.error = e
+            self.returncode = -1
+        finally:
+            self.finished = time.time()
+            self.finished_event.set()
+
+    def run_chunks(self):
+        chunk_jobs = []
+        for i, pj in enumerate(self.chunk_pjs):
+            job = self.launch_chunk(i)
+            if job is None:
+                return -1
+            chunk_jobs.append(job)
+        for i, job in enumerate(chunk_jobs):
+            pj = self.chunk_pjs[i]
+            code = job.wait()
+            # only the chunk out of memory is repeated, finished chunks are kept
+            while not self.cancelled and pj.insufficient_memory and self.retry and pj.retry_after_oom():
+                self.lines.put("*** Chunk %d out of memory, repeated: %s ***" % (
+                    i + 1, recovery.describe(pj.attempt, pj.xmx, pj.cfg)))
+                job = self.launch_chunk(i)
+                if job is None:
+                    return -1
+                code = job.wait()
+            if self.cancelled:
+                return code
+            if job.error is not None or code != 0:
+                reason = "out of memory" if pj.insufficient_memory else "exit code %s" % code
+                if job.error is not None:
+                    reason = str(job.error)
+                raise ChunkFailure("chunk %d failed (%s), see %s" % (i + 1, reason, pj.out_dir))
+            if pj.degraded():
+                # merged tunnels include ones computed with fewer approximating balls
+                self.merge_pj.reduced = True
+        self.lines.put("*** All %d chunks computed, clustering tunnels of the whole trajectory ***" % len(chunk_jobs))
+        merge_tunnels([pj.out_dir for pj in self.chunk_pjs], self.merge_pj.out_dir)
+        job = self.launch(self.merge_pj, "", self.log_file)
+        if job is None:
+            return -1
+        code = job.wait()
+        self.peak_mb = job.peak_mb
+        # failures of the merge job are shown with its command
+        self.error = job.error
+        return code
+
+    def launch_chunk(self, i):
+        pj = self.chunk_pjs[i]
+        return self.launch(pj, "[chunk %d] " % (i + 1), os.path.join(pj.out_dir, "plugin_output.txt"))
+
+    def cancel(self):
+        with self.lock:
+            self.cancelled = True
+            jobs = list(self.jobs)
+        for job in jobs:
+            job.cancel()
+
+    def waiting(self):
+        with self.lock:
+            started = [job for job in self.jobs if job.started is not None]
+        return not started and not self.finished_event.is_set()
+
+
+# make_pyjava(cfg, out_dir) creates the PyJava of one job, None when Java is missing
+def create(make_pyjava, cfg, out_dir, snapshots, chunks, log_file=None, retry=True):
+    chunk_pjs = []
+    for i, (first, last) in enumerate(windows(snapshots, chunks)):
+        d = os.path.join(out_dir, CHUNKS_SUBDIR, str(i + 1))
+        os.makedirs(d)
+        chunk_cfg = os.path.join(d, "config.txt")
+        update_config(cfg, chunk_cfg, {"first_frame": first, "last_frame": last, "time_sparsity": 1,
+                                       "stop_after": "tunnels", "load_tunnels": "no", "load_cluster_tree": "no"})
+        pj = make_pyjava(chunk_cfg, d)
+        if pj.java_missing:
+            return None
+        chunk_pjs.append(pj)
+    update_config(cfg, cfg, {"load_tunnels": "yes", "load_cluster_tree": "no"})
+    merge_pj = make_pyjava(cfg, out_dir)
+    return ChunkedJob(chunk_pjs, merge_pj, log_file, retry)
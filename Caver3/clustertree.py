@@ -0,0 +1,223 @@
+#
+# Average link cluster tree of a finished run, cut at any threshold
+#
+# CAVER saves the dendrogram of tunnel clustering as data/tree.txt, one
+# merge per line: "child<TAB>child<TAB>distance<TAB>parent". Ids are 1-based,
+# leaves are 1..n and parents are numbered from n + 1, distances do not
+# decrease (AverageLinkClusteringMurtagh.saveTreeCompatible, read back by
+# Clustering.loadTree, which stops at the first merge not below the
+# threshold). The merges are kept in flat arrays, so cutting the tree at a
+# new clustering_threshold is a single pass over them and needs no Java.
+#
+# Leaves are grains of tunnels (grain_size) in the order of their cheapest
+# tunnel, tunnels being clustered sorted by cost. Only when every grain is
+# one tunnel is leaf i the i-th cheapest tunnel, and cluster objects loaded
+# by view_plugin.py are matched to the groups of the tree cut at the
+# threshold of the run through the costs in tunnel_characteristics.csv
+# (by their numbers of tunnels when costs tie and all of them differ).
+# Otherwise nothing is matched. Larger thresholds then merge whole loaded
+# clusters, smaller thresholds split them, which needs re-clustering to be
+# shown.
+#
+
+import ast
+import csv
+import os
+import re
+from array import array
+
+TREE_FILE = "tree.txt"
+
+
+class ClusterTree:
+    def __init__(self, leaves, first, second, height):
+        # merge i joins nodes first[i] and second[i] into node leaves + i,
+        # nodes below leaves are grains of tunnels
+        self.leaves = leaves
+        self.first = first
+        self.second = second
+        self.height = height
+
+    @classmethod
+    def load(cls, path, tunnels=0):
+        merges = []
+        handler = open(path)
+        for line in handler:
+            tokens = re.split(r"[\t ;]+", line.strip())
+            if len(tokens) < 4:
+                continue
+            children = [int(tokens[0]), int(tokens[1])]
+            merges.append((children, float(tokens[2]), int(tokens[3])))
+        handler.close()
+        # parents follow the leaves, leaves never merged are not in the file
+        leaves = merges[0][2] - 1 if merges else tunnels
+        current = dict([(leaf, leaf - 1) for leaf in range(1, leaves + 1)])
+        first = array('i')
+        second = array('i')
+        height = array('d')
+        for i, (children, distance, parent) in enumerate(merges):
+            first.append(current[children[0]])
+            second.append(current[children[1]])
+            height.append(distance)
+            current[parent] = leaves + i
+        return cls(leaves, first, second, height)
+
+    # merges applied by CAVER for given threshold, it stops at the first
+    # merge not below the threshold
+    def merges_below(self, threshold):
+        for i, h in enumerate(self.height):
+            if h >= threshold:
+                return i
+        return len(self.height)
+
+    # cluster label of every tunnel, labels numbered in the order of first tunnels
+    def cut(self, threshold):
+        k = self.merges_below(threshold)
+        up = array('i', range(self.leaves + k))
+        for i in range(k):
+            up[self.first[i]] = self.leaves + i
+            up[self.second[i]] = self.leaves + i
+        roots = {}
+        labels = array('i', [0] * self.leaves)
+        for leaf in range(self.leaves):
+            node = leaf
+            while up[node] != node:
+                node = up[node]
+            # path compression
+            n = leaf
+            while up[n] != node:
+                up[n], n = node, up[n]
+            if node not in roots:
+                roots[node] = len(roots)
+            labels[leaf] = roots[node]
+        return labels
+
+    def count(self, threshold):
+        return self.leaves - self.merges_below(threshold)
+
+    def range(self):
+        if len(self.height) == 0:
+            return 0.0, 0.0
+        return self.height[0], self.height[len(self.height) - 1]
+
+
+def find_tree(run_dir):
+    for root, dirs, files in os.walk(run_dir):
+        if TREE_FILE in files:
+            return os.path.join(root, TREE_FILE)
+    return None
+
+
+# (cost, cluster id) of every tunnel of the output clusters
+def output_tunnels(run_dir):
+    path = os.path.join(run_dir, "analysis", "tunnel_characteristics.csv")
+    tunnels = []
+    if not os.path.isfile(path):
+        return tunnels
+    with open(path) as handler:
+        for row in csv.DictReader(handler, skipinitialspace=True):
+            row = dict([(k.strip(), v) for k, v in row.items() if k is not None])
+            try:
+                cluster = int(row.get("Tunnel cluster"))
+            except (TypeError, ValueError):
+                continue
+            try:
+                cost = float(row.get("Cost"))
+            except (TypeError, ValueError):
+                cost = None
+            tunnels.append((cost, cluster))
+    return tunnels
+
+
+def group_sizes(labels):
+    sizes = {}
+    for label in labels:
+        sizes[label] = sizes.get(label, 0) + 1
+    return sizes
+
+
+# {label: cluster id} from the cost order of the tunnels, None when the
+# costs do not identify the leaves or the groups differ from the clusters
+def match_by_cost(labels, tunnels):
+    costs = [cost for cost, cluster in tunnels]
+    if len(tunnels) != len(labels) or None in costs or len(set(costs)) != len(costs):
+        return None
+    clusters = {}
+    for leaf, (cost, cluster) in enumerate(sorted(tunnels)):
+        clusters.setdefault(labels[leaf], set()).add(cluster)
+    matched = {}
+    for label in clusters:
+        if len(clusters[label]) != 1:
+            return None
+        matched[label] = clusters[label].pop()
+    if len(set(matched.values())) != len(matched):
+        return None
+    return matched
+
+
+# {label: cluster id} from the numbers of tunnels, None when any cluster
+# shares its size with another cluster or group
+def match_by_size(labels, tunnels):
+    groups = group_sizes(labels)
+    sizes = group_sizes([cluster for cost, cluster in tunnels])
+    matched = {}
+    for cluster in sizes:
+        same = [label for label in groups if groups[label] == sizes[cluster]]
+        if len(same) != 1 or list(sizes.values()).count(sizes[cluster]) != 1:
+            return None
+        matched[same[0]] = cluster
+    return matched
+
+
+# output cluster of every group of the tree cut at the threshold of the run,
+# matched is None when the loaded clusters cannot be told apart in the tree
+def match_clusters(tree, threshold, tunnels):
+    labels = tree.cut(threshold)
+    if tree.leaves != len(tunnels):
+        # grains of more tunnels, or tunnels left out of the output
+        return labels, None
+    matched = match_by_cost(labels, tunnels)
+    if matched is None:
+        matched = match_by_size(labels, tunnels)
+    return labels, matched
+
+
+# output clusters merged at a new threshold and output clusters which would split
+def regroup(tree, labels, matched, threshold):
+    new_labels = tree.cut(threshold)
+    parts = {}
+    for leaf, label in enumerate(labels):
+        if label in matched:
+            parts.setdefault(matched[label], set()).add(new_labels[leaf])
+    split = sorted([c for c in parts if len(parts[c]) > 1])
+    groups = {}
+    for c in sorted(parts):
+        groups.setdefault(min(parts[c]), []).append(c)
+    return sorted(groups.values()), split
+
+
+# computation id used for object names by pymol/view_plugin.py of the run
+def computation_id(run_dir):
+    path = os.path.join(run_dir, "pymol", "view_plugin.py")
+    if not os.path.isfile(path):
+        return None
+    with open(path) as handler:
+        for line in handler:
+            m = re.match(r"\s*id\s*=\s*(.+?)\s*$", line)
+            if m:
+                try:
+                    return str(ast.literal_eval(m.group(1)))
+                except (ValueError, SyntaxError):
+                    return m.group(1).strip("'\"")
+    return None
+
+
+# {cluster id: object names} of loaded clusters of given computation
+def cluster_objects(cid, names):
+    pattern = re.compile(re.escape(cid) + r"_t(\d+)_")
+    objects = {}
+    for name in names:
+        m = pattern.match(name)
+        if m:
+            objects.setdefault(int(m.group(1)), []).append(name)
+    return objects
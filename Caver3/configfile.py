@@ -0,0 +1,54 @@
+#
+# Reading and rewriting of CAVER configuration files outside the GUI
+#
+
+
+def parse_config(path):
+    keys = []
+    values = {}
+    handler = open(path)
+    for line in handler.readlines():
+        liner = line.strip()
+        if '#' in liner:
+            liner = liner[0:liner.find("#")].strip()
+        if liner == "":
+            continue
+        parsed = liner.split()
+        key = parsed[0]
+        val = " ".join(parsed[1:])
+        if key in values:
+            values[key] = values[key] + " " + val
+        else:
+            keys.append(key)
+            values[key] = val
+    handler.close()
+    return keys, values
+
+
+def config_values(path):
+    return parse_config(path)[1]
+
+
+# copies config src to dst with values of keys replaced by changes,
+# keys with value None are removed, missing keys are appended
+def update_config(src, dst, changes):
+    handler = open(src)
+    lines = handler.readlines()
+    handler.close()
+    done = set()
+    out = []
+    for line in lines:
+        parsed = line.split("#")[0].split()
+        if parsed and parsed[0] in changes:
+            key = parsed[0]
+            if key not in done and changes[key] is not None:
+                out.append("%s %s\n" % (key, changes[key]))
+            done.add(key)
+        else:
+            out.append(line if line.endswith("\n") else line + "\n")
+    for key in sorted(changes):
+        if key not in done and changes[key] is not None:
+            out.append("%s %s\n" % (key, changes[key]))
+    handler = open(dst, 'w')
+    handler.writelines(out)
+    handler.close()
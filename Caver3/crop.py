@@ -0,0 +1,87 @@
+#
+# Cropping of the structure around the starting point
+#
+# Only whole residues having an atom within the crop radius plus a safety
+# margin of the starting point are exported. Tunnels reaching beyond the
+# crop radius run through a region whose surroundings were removed, the
+# clusters containing them are listed in crop.txt of the output directory.
+#
+
+import math
+import os
+
+CROP_LOG = "crop.txt"
+
+# atoms kept beyond the crop radius (A), covers the probe and atom radii
+MARGIN = 5.0
+
+
+class GridIndex:
+    def __init__(self, points, cell):
+        # points is a list of (x, y, z)
+        self.points = points
+        self.cell = float(cell)
+        self.cells = {}
+        for i, p in enumerate(points):
+            self.cells.setdefault(self.key(p), []).append(i)
+
+    def key(self, p):
+        return (int(math.floor(p[0] / self.cell)), int(math.floor(p[1] / self.cell)), int(math.floor(p[2] / self.cell)))
+
+    # indices of points within radius of center
+    def within(self, center, radius):
+        lo = self.key([c - radius for c in center])
+        hi = self.key([c + radius for c in center])
+        r2 = radius * radius
+        found = []
+        for x in range(lo[0], hi[0] + 1):
+            for y in range(lo[1], hi[1] + 1):
+                for z in range(lo[2], hi[2] + 1):
+                    for i in self.cells.get((x, y, z), ()):
+                        p = self.points[i]
+                        if (p[0] - center[0]) ** 2 + (p[1] - center[1]) ** 2 + (p[2] - center[2]) ** 2 <= r2:
+                            found.append(i)
+        return found
+
+
+# residues (keys given per atom) with an atom within radius + MARGIN of center
+def residues_near(points, residues, center, radius):
+    index = GridIndex(points, max(4.0, (radius + MARGIN) / 4.0))
+    return set([residues[i] for i in index.within(center, radius + MARGIN)])
+
+
+def sphere_lines(path):
+    handler = open(path)
+    for line in handler:
+        if line.startswith("ATOM") or line.startswith("HETATM"):
+            try:
+                yield (float(line[30:38]), float(line[38:46]), float(line[46:54])), float(line[60:66])
+            except ValueError:
+                continue
+    handler.close()
+
+
+# clusters of out_dir with spheres reaching over the crop radius
+def boundary_clusters(out_dir, center, radius):
+    flagged = []
+    cluster_dir = os.path.join(out_dir, "data", "clusters_timeless")
+    if not os.path.isdir(cluster_dir):
+        return flagged
+    for fn in sorted(os.listdir(cluster_dir)):
+        if not fn.lower().endswith((".pdb", ".ent")):
+            continue
+        for p, r in sphere_lines(os.path.join(cluster_dir, fn)):
+            if math.sqrt(sum([(a - b) ** 2 for a, b in zip(p, center)])) + r > radius:
+                flagged.append(os.path.splitext(fn)[0])
+                break
+    return flagged
+
+
+def record(out_dir, center, radius, atoms, total, flagged):
+    handler = open(os.path.join(out_dir, CROP_LOG), 'w')
+    handler.write("center %.3f %.3f %.3f\n" % tuple(center))
+    handler.write("radius %.2f (+ %.2f margin)\n" % (radius, MARGIN))
+    handler.write("atoms %d of %d\n" % (atoms, total))
+    for name in flagged:
+        handler.write("boundary %s\n" % name)
+    handler.close()
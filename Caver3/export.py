@@ -0,0 +1,186 @@
+#
+# Export of the analyzed structure from PyMOL to the CAVER inputs
+#
+# Atoms of the selected object are streamed to a PDB file by
+# cmd.iterate_state, no model copy is built and no other object of the
+# session is touched (cmd.save needed a session-wide cmd.sort to keep the
+# atom order).
+#
+
+import os
+import time
+
+from . import crop
+
+try:
+    from pymol import cmd
+except ImportError:
+    cmd = None
+
+# approximate size of one atom of a chempy model returned by cmd.get_model
+MODEL_ATOM_BYTES = 1500
+
+WATER_NAMES = ["HOH", "WAT", "H2O", "DOD", "D2O", "TIP", "TIP3", "TIP4", "T3P", "T4P", "SPC", "SOL"]
+
+ATOM_FIELDS = "type, name, alt, resn, chain, resi, resv, x, y, z, q, b, elem, segi, formal_charge"
+
+
+def pdb_atom_name(name, elem):
+    if len(name) >= 4:
+        return name[:4]
+    # one letter elements start in column 14
+    if len(elem) == 1 and not name[:1].isdigit():
+        return " " + name.ljust(3)
+    return name.ljust(4)
+
+
+# last four characters like the PDB writer of PyMOL, negative numbers keep their sign
+# residue numbers fitting the 4 columns of PDB records
+MIN_RESIDUE = -999
+MAX_RESIDUE = 9999
+
+
+def residue_number(resv):
+    return "%4d" % resv
+
+
+def insertion_code(resi, resv):
+    code = resi[len(str(resv)):]
+    return code[:1] if code else " "
+
+
+# atoms handed to CAVER, selected in PyMOL where possible
+class AtomFilter:
+    def __init__(self, residues=None, hydrogens=False, waters=False, altlocs=False, crop=None):
+        # residue names to keep (None = all), remove hydrogens, waters, other than first alternate locations
+        self.residues = residues
+        self.hydrogens = hydrogens
+        self.waters = waters
+        self.altlocs = altlocs
+        # (center, radius) of the crop sphere or None
+        self.crop = crop
+
+    def selection(self, selection):
+        parts = ["(" + selection + ")"]
+        if self.residues is not None:
+            parts.append("resn " + "+".join(self.residues))
+        if self.hydrogens:
+            parts.append("not hydro")
+        if self.waters:
+            parts.append("not resn " + "+".join(WATER_NAMES))
+        return " and ".join(parts)
+
+
+class PdbWriter:
+    def __init__(self, handler, first_altloc=False):
+        self.handler = handler
+        self.atoms = 0
+        self.chain = None
+        # first alternate location of each residue, others are skipped
+        self.first_altloc = first_altloc
+        self.altlocs = {}
+        # (segi, chain, resi) of residues to write, None = all
+        self.residues = None
+        # residues numbered out of MIN_RESIDUE..MAX_RESIDUE, they are not written
+        self.overflow = []
+
+    def atom(self, type, name, alt, resn, chain, resi, resv, x, y, z, q, b, elem, segi, formal_charge):
+        if self.residues is not None and (segi, chain, resi) not in self.residues:
+            return
+        if self.first_altloc and alt:
+            key = (segi, chain, resi)
+            if self.altlocs.setdefault(key, alt) != alt:
+                return
+            alt = ""
+        if not MIN_RESIDUE <= resv <= MAX_RESIDUE:
+            # truncated numbers would duplicate other residues in the results of CAVER
+            if (segi, chain, resi) not in self.overflow:
+                self.overflow.append((segi, chain, resi))
+            return
+        chain = chain[:1] or " "
+        if self.chain is not None and chain != self.chain:
+            self.handler.write("TER\n")
+        self.chain = chain
+        self.atoms += 1
+        charge = ""
+        if formal_charge:
+            charge = "%d%s" % (abs(formal_charge), "+" if formal_charge > 0 else "-")
+        self.handler.write("%-6s%5d %4s%1s%3s %1s%4s%1s   %8.3f%8.3f%8.3f%6.2f%6.2f      %-4s%2s%2s\n" % (
+            type[:6], self.atoms % 100000, pdb_atom_name(name, elem), alt[:1] or " ", resn[:3].rjust(3),
+            chain, residue_number(resv), insertion_code(resi, resv), x, y, z, q, b, segi[:4], elem[:2].upper().rjust(2), charge))
+
+    def close(self):
+        if self.atoms:
+            self.handler.write("TER\n")
+        self.handler.write("END\n")
+
+
+# writes atoms of selection in given state (-1 = current) to path, returns the number of atoms
+# residues given as in PdbWriter.residues, by default the crop is evaluated in state
+def write_pdb(path, selection, state=-1, atom_filter=None, residues=None):
+    if atom_filter is None:
+        atom_filter = AtomFilter()
+    handler = open(path, 'w')
+    writer = PdbWriter(handler, atom_filter.altlocs)
+    selection = atom_filter.selection(selection)
+    try:
+        writer.residues = residues
+        if residues is None and atom_filter.crop is not None:
+            writer.residues = crop_residues(selection, state, atom_filter.crop)
+        cmd.iterate_state(state, selection, "write(" + ATOM_FIELDS + ")", space={"write": writer.atom})
+        writer.close()
+        if writer.overflow:
+            segi, chain, resi = writer.overflow[0]
+            raise ValueError("%d residues of %s are numbered out of %d..%d (e.g. %s/%s/%s), which PDB files "
+                             "cannot hold; renumber them (alter) or leave them out of the selection" % (
+                                 len(writer.overflow), selection, MIN_RESIDUE, MAX_RESIDUE, segi, chain, resi))
+    finally:
+        handler.close()
+    return writer.atoms
+
+
+def crop_residues(selection, state, sphere):
+    points = []
+    residues = []
+    cmd.iterate_state(state, selection, "add((x, y, z), (segi, chain, resi))",
+                      space={"add": lambda p, r: (points.append(p), residues.append(r))})
+    center, radius = sphere
+    return crop.residues_near(points, residues, center, radius)
+
+
+def export_structure(selection, inputs, atom_filter=None):
+    start = time.time()
+    path = os.path.join(inputs, selection + ".pdb")
+    atoms = write_pdb(path, selection, atom_filter=atom_filter)
+    total = cmd.count_atoms("(" + selection + ")")
+    others = cmd.count_atoms("all") - total
+    print("*** Exported %d of %d atoms of %s in %.2f s (%d KB) ***" % (atoms, total, selection, time.time() - start, os.path.getsize(path) // 1024))
+    print("(two unused model copies, ~%d MB, and sorting of %d atoms of other objects skipped)" % (
+        2 * total * MODEL_ATOM_BYTES // (1024 * 1024), max(0, others)))
+    return atoms, total
+
+
+# writes every step-th state of selection as a snapshot,
+# returns the number of snapshots, atoms per snapshot and atoms of selection
+def export_trajectory(selection, inputs, step=1, atom_filter=None):
+    start = time.time()
+    if atom_filter is None:
+        atom_filter = AtomFilter()
+    states = list(range(1, cmd.count_states("(" + selection + ")") + 1, step))
+    total = cmd.count_atoms("(" + selection + ")")
+    if not states:
+        return 0, 0, total
+    # all snapshots need the same atoms, the crop is evaluated in the first one
+    residues = None
+    if atom_filter.crop is not None:
+        residues = crop_residues(atom_filter.selection(selection), states[0], atom_filter.crop)
+    digits = len(str(states[-1]))
+
+    # cmd.iterate_state holds the API lock, states are written one by one
+    atoms = 0
+    for state in states:
+        path = os.path.join(inputs, "%s_%0*d.pdb" % (selection, digits, state))
+        atoms = write_pdb(path, selection, state, atom_filter, residues)
+    print("*** Exported %d states (every %d. of %s, %d atoms each) in %.2f s ***" % (
+        len(states), step, selection, atoms, time.time() - start))
+    return len(states), atoms, total
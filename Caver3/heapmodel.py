@@ -0,0 +1,172 @@
+#
+# Java heap needed by a CAVER job, predicted from previous runs
+#
+# Every finished run appends its job features, -Xmx, peak heap use reported
+# by the garbage collector and whether it ran out of memory to a history
+# file. The prediction is a least squares fit of
+#
+#   peak = c0 + c1 * atoms * balls + c2 * snapshots * tunnels / probe_radius
+#
+# (Voronoi diagram of one snapshot, tunnels kept for all snapshots) scaled
+# so that it covers every observed peak and exceeds the heap of every run
+# which ran out of memory. Without enough history the maximum heap is used.
+#
+
+import json
+import os
+
+from . import jvm
+from .configfile import config_values
+
+HISTORY = "heap_history.jsonl"
+
+# only the most recent runs are fitted
+HISTORY_LIMIT = 500
+
+# fitted model needs at least this many successful runs
+MIN_RUNS = 4
+
+MIN_HEAP_MB = 1000
+
+# prior coefficients (MB)
+PRIOR = [500.0, 0.004, 0.0005]
+
+SAFETY = 1.3
+RIDGE = 1e-3
+MAX_SAFETY = 3.0
+
+
+class JobFeatures:
+    def __init__(self, atoms, snapshots, balls, probe_radius, max_tunnels):
+        self.atoms = atoms
+        self.snapshots = snapshots
+        self.balls = balls
+        self.probe_radius = probe_radius
+        self.max_tunnels = max_tunnels
+
+    def vector(self):
+        return [1.0,
+                float(self.atoms * self.balls),
+                self.snapshots * float(self.max_tunnels) / max(self.probe_radius, 0.1)]
+
+    def as_dict(self):
+        return {"atoms": self.atoms, "snapshots": self.snapshots, "balls": self.balls,
+                "probe_radius": self.probe_radius, "max_tunnels": self.max_tunnels}
+
+
+# snapshots of a trajectory share their atoms, only the first one is read
+def count_atoms(inputs):
+    files = sorted([fn for fn in os.listdir(inputs) if fn.lower().endswith((".pdb", ".ent"))])
+    atoms = 0
+    if files:
+        handler = open(os.path.join(inputs, files[0]))
+        for line in handler:
+            if line.startswith("ATOM") or line.startswith("HETATM"):
+                atoms += 1
+        handler.close()
+    return atoms, len(files)
+
+
+def job_features(inputs, cfg):
+    atoms, snapshots = count_atoms(inputs)
+    values = config_values(cfg)
+    first = int(values.get("first_frame", 1))
+    last = int(values.get("last_frame", snapshots))
+    sparsity = max(1, int(values.get("time_sparsity", 1)))
+    if snapshots > 1:
+        snapshots = max(1, (min(last, snapshots) - first) // sparsity + 1)
+    return JobFeatures(atoms, snapshots,
+                       int(values.get("number_of_approximating_balls", 12)),
+                       float(values.get("probe_radius", 0.9)),
+                       int(values.get("max_number_of_tunnels", 10000)))
+
+
+def load_history():
+    path = os.path.join(jvm.CACHE_LOCATION, HISTORY)
+    if not os.path.isfile(path):
+        return []
+    records = []
+    handler = open(path)
+    for line in handler.readlines()[-HISTORY_LIMIT:]:
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            pass
+    handler.close()
+    return records
+
+
+# lines are appended, so concurrent batch workers do not overwrite each other
+def record(features, xmx, peak_mb, oom):
+    entry = features.as_dict()
+    entry.update({"xmx": xmx, "peak_mb": peak_mb, "oom": bool(oom)})
+    try:
+        if not os.path.isdir(jvm.CACHE_LOCATION):
+            os.makedirs(jvm.CACHE_LOCATION)
+        handler = open(os.path.join(jvm.CACHE_LOCATION, HISTORY), 'a')
+        handler.write(json.dumps(entry, sort_keys=True) + "\n")
+        handler.close()
+    except (IOError, OSError) as e:
+        print("Warning: cannot record heap history: " + str(e))
+
+
+def solve(a, b):
+    # Gauss-Jordan elimination with partial pivoting, None for singular systems
+    n = len(b)
+    m = [list(a[i]) + [b[i]] for i in range(n)]
+    for c in range(n):
+        p = max(range(c, n), key=lambda r: abs(m[r][c]))
+        if abs(m[p][c]) < 1e-12:
+            return None
+        m[c], m[p] = m[p], m[c]
+        for r in range(n):
+            if r != c:
+                f = m[r][c] / m[c][c]
+                m[r] = [x - f * y for x, y in zip(m[r], m[c])]
+    return [m[i][n] / m[i][i] for i in range(n)]
+
+
+def predict(coefficients, features):
+    return sum([c * x for c, x in zip(coefficients, features.vector())])
+
+
+def successful(records):
+    return [r for r in records if not r.get("oom") and r.get("peak_mb")]
+
+
+def fit(records):
+    runs = successful(records)
+    if len(runs) < MIN_RUNS:
+        return PRIOR, SAFETY
+    xs = [JobFeatures(r["atoms"], r["snapshots"], r["balls"], r["probe_radius"], r["max_tunnels"]).vector() for r in runs]
+    ys = [float(r["peak_mb"]) for r in runs]
+    # features differ by orders of magnitude, fit in scaled space
+    scale = [max([abs(x[i]) for x in xs]) or 1.0 for i in range(3)]
+    xs_scaled = [[x[i] / scale[i] for i in range(3)] for x in xs]
+    # small ridge term keeps the system solvable when a feature does not vary
+    ata = [[sum([x[i] * x[j] for x in xs_scaled]) + (RIDGE if i == j else 0.0) for j in range(3)] for i in range(3)]
+    aty = [sum([x[i] * y for x, y in zip(xs_scaled, ys)]) for i in range(3)]
+    solution = solve(ata, aty)
+    if solution is None:
+        return PRIOR, SAFETY
+    coefficients = [max(0.0, solution[i] / scale[i]) for i in range(3)]
+    coefficients[0] = max(coefficients[0], 1.0)
+    margin = SAFETY
+    for r in records:
+        f = JobFeatures(r["atoms"], r["snapshots"], r["balls"], r["probe_radius"], r["max_tunnels"])
+        p = predict(coefficients, f)
+        if r.get("oom"):
+            margin = max(margin, 1.1 * r["xmx"] / p)
+        elif r.get("peak_mb"):
+            margin = max(margin, float(r["peak_mb"]) / p)
+    return coefficients, min(margin, MAX_SAFETY)
+
+
+def estimate(features, max_xmx):
+    records = load_history()
+    if len(successful(records)) < MIN_RUNS:
+        # the model is not calibrated yet, the probed maximum is used as before
+        return max_xmx
+    coefficients, margin = fit(records)
+    need = predict(coefficients, features) * margin
+    return int(min(max_xmx, max(MIN_HEAP_MB, need)))
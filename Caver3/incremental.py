@@ -0,0 +1,130 @@
+#
+# Incremental recomputation after a change of parameters
+#
+# Parameters are classified by the first stage of the CAVER pipeline they
+# affect: tunnels, cluster tree, clustering (cutting the tree) and outputs.
+# When an earlier run computed the same structures and differs only in
+# parameters of later stages, its tunnels (and the cluster tree, when none
+# of its parameters changed) are loaded instead of being computed again.
+# Unknown parameters invalidate everything.
+#
+
+import os
+
+from . import checkpoint, recluster
+from .configfile import config_values
+from .resultcache import IGNORED_KEYS, inputs_digest
+
+CLUSTERING = "clustering"
+OUTPUT = "output"
+
+# pipeline stages in the order they are computed
+STAGES = [checkpoint.TUNNELS, checkpoint.CLUSTER_TREE, CLUSTERING, OUTPUT]
+
+CLUSTERING_KEYS = ["clustering_threshold", "max_output_clusters", "one_tunnel_in_snapshot",
+                   "generate_unclassified_cluster"]
+
+OUTPUT_KEYS = ["save_zones", "save_dynamics_visualization", "generate_summary",
+               "generate_tunnel_characteristics", "generate_tunnel_profiles", "generate_histograms",
+               "bottleneck_histogram", "throughput_histogram", "generate_bottleneck_heat_map",
+               "bottleneck_heat_map_range", "bottleneck_heat_map_element_size",
+               "generate_profile_heat_map", "profile_heat_map_resolution", "profile_heat_map_range",
+               "profile_heat_map_element_size", "compute_tunnel_residues", "residue_contact_distance",
+               "compute_bottleneck_residues", "bottleneck_contact_distance", "average_surface_frame",
+               "average_surface_global", "average_surface_smoothness_angle",
+               "average_surface_point_min_angle", "average_surface_tunnel_sampling_step",
+               "profile_tunnel_sampling_step", "visualization_tunnel_sampling_step",
+               "visualize_tunnels_per_cluster", "visualization_subsampling", "compute_errors",
+               "save_error_profiles", "generate_trajectory"]
+
+# parameters controlling how the run is executed, not what it computes
+SKIPPED_KEYS = IGNORED_KEYS + ["load_tunnels", "load_cluster_tree", "stop_after", "swap"]
+
+# only the most recent runs are compared, inputs of each are hashed
+MAX_CANDIDATES = 5
+
+
+def stage_of(key):
+    if key in recluster.TREE_KEYS:
+        return checkpoint.CLUSTER_TREE
+    if key in CLUSTERING_KEYS:
+        return CLUSTERING
+    if key in OUTPUT_KEYS:
+        return OUTPUT
+    return checkpoint.TUNNELS
+
+
+def changed_keys(old_cfg, new_cfg):
+    old = config_values(old_cfg)
+    new = config_values(new_cfg)
+    changed = []
+    for key in sorted(set(old) | set(new)):
+        if key in SKIPPED_KEYS:
+            continue
+        if " ".join(old.get(key, "").split()) != " ".join(new.get(key, "").split()):
+            changed.append(key)
+    return changed
+
+
+# earliest stage invalidated by the changed parameters, None when nothing changed
+def first_invalidated(changed):
+    stages = [STAGES.index(stage_of(key)) for key in changed]
+    if not stages:
+        return None
+    return STAGES[min(stages)]
+
+
+def structure_files(input_dir):
+    files = []
+    for fn in sorted(os.listdir(input_dir)):
+        path = os.path.join(input_dir, fn)
+        if fn.lower().endswith((".pdb", ".ent")) and os.path.isfile(path):
+            files.append((fn, os.path.getsize(path)))
+    return files
+
+
+def candidates(out_home, exclude):
+    runs = []
+    for fn in os.listdir(out_home):
+        path = os.path.join(out_home, fn)
+        if fn.isdigit() and os.path.abspath(path) != os.path.abspath(exclude):
+            runs.append((int(fn), path))
+    return [path for n, path in sorted(runs, reverse=True)]
+
+
+# earlier run of the same inputs needing the least recomputation,
+# returns (run_dir, first invalidated stage, changed keys) or None
+def find_base(out_home, inputs, cfg, exclude):
+    files = structure_files(inputs)
+    digest = None
+    best = None
+    checked = 0
+    for run in candidates(out_home, exclude):
+        if checked >= MAX_CANDIDATES:
+            break
+        previous = recluster.run_config(run)
+        run_inputs = os.path.join(run, "inputs")
+        if previous is None or checkpoint.TUNNELS not in checkpoint.completed(run):
+            continue
+        checked += 1
+        changed = changed_keys(previous, cfg)
+        stage = first_invalidated(changed)
+        if stage == checkpoint.TUNNELS or structure_files(run_inputs) != files:
+            continue
+        if digest is None:
+            digest = inputs_digest(inputs)
+        if inputs_digest(run_inputs) != digest:
+            continue
+        rank = STAGES.index(stage) if stage is not None else len(STAGES)
+        if best is None or rank > best[0]:
+            best = (rank, run, stage, changed)
+    if best is None:
+        return None
+    return best[1:]
+
+
+def describe(run_dir, changed, load_tree):
+    reused = "tunnels and cluster tree" if load_tree else "tunnels"
+    if not changed:
+        return "parameters are identical to " + run_dir + ", its " + reused + " are reused"
+    return "changed " + ", ".join(changed) + ", " + reused + " of " + run_dir + " are reused"
@@ -0,0 +1,229 @@
+#
+# Background execution of CAVER (Java) processes
+#
+# The process is started in its own process group, its output is read by a
+# worker thread and handed over through a queue, so the Tk main loop only
+# polls the queue and never blocks on Java.
+#
+
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+# size of the log file before it is rotated (at most one old copy is kept)
+LOG_LIMIT = 10 * 1024 * 1024
+
+
+class BoundedLog:
+    def __init__(self, path, limit=LOG_LIMIT):
+        self.path = path
+        self.limit = limit
+        self.size = 0
+        self.handler = open(path, 'w')
+
+    def write(self, line):
+        if self.size + len(line) + 1 > self.limit:
+            self.handler.close()
+            old = self.path + ".1"
+            if os.path.exists(old):
+                os.remove(old)
+            os.rename(self.path, old)
+            self.handler = open(self.path, 'w')
+            self.size = 0
+        self.handler.write(line)
+        self.handler.write("\n")
+        self.size += len(line) + 1
+
+    def close(self):
+        self.handler.close()
+
+
+def kill_tree(process):
+    if process is None or process.poll() is not None:
+        return
+    if os.name == 'nt':
+        subprocess.call(["taskkill", "/F", "/T", "/PID", str(process.pid)],
+                        stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        return
+    try:
+        pgid = os.getpgid(process.pid)
+        os.killpg(pgid, signal.SIGTERM)
+        for i in range(20):
+            if process.poll() is not None:
+                return
+            time.sleep(0.1)
+        os.killpg(pgid, signal.SIGKILL)
+    except OSError:
+        pass
+
+
+class CaverJob:
+    def __init__(self, args, log_file=None, queued=True):
+        self.args = args
+        self.log_file = log_file
+        # blocking callers read the output through listeners only
+        self.queued = queued
+        self.lines = queue.Queue()
+        self.listeners = []
+        self.process = None
+        self.thread = None
+        self.returncode = None
+        self.cancelled = False
+        self.error = None
+        self.started = None
+        self.finished = None
+        self.finished_event = threading.Event()
+        # cores the process is pinned to (None = no pinning)
+        self.cpu_set = None
+        # peak resident memory of the process (MB), None when unknown
+        self.peak_mb = None
+        self.finish_callbacks = []
+
+    # listener(line) is called from the reader thread, it must not touch Tk
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    # callback(job) is called from the reader thread once the process exits
+    def add_finish_callback(self, callback):
+        self.finish_callbacks.append(callback)
+
+    def start(self):
+        kwargs = {}
+        if os.name == 'nt':
+            kwargs['creationflags'] = subprocess.CREATE_NEW_PROCESS_GROUP
+        elif sys.version_info >= (3, 2):
+            # preexec_fn is unsafe in a process with threads (PyMOL, the scheduler)
+            kwargs['start_new_session'] = True
+        else:
+            kwargs['preexec_fn'] = os.setsid
+        self.started = time.time()
+        self.process = subprocess.Popen(self.args, stdout=subprocess.PIPE,
+                                        stderr=subprocess.STDOUT, stdin=subprocess.PIPE, **kwargs)
+        self.process.stdin.close()
+        if self.cpu_set:
+            self.pin(self.process.pid)
+        self.thread = threading.Thread(target=self.pump)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    # threads started later inherit the cores of the thread creating them
+    def pin(self, pid):
+        tasks = "/proc/%d/task" % pid
+        try:
+            tids = [int(t) for t in os.listdir(tasks)] if os.path.isdir(tasks) else [pid]
+            for tid in tids:
+                os.sched_setaffinity(tid, self.cpu_set)
+        except OSError:
+            # the process (or one of its threads) already exited
+            pass
+
+    # job which could not be started (error None means cancelled before start)
+    def fail(self, error):
+        self.error = error
+        self.returncode = -1
+        self.finished = time.time()
+        self.finished_event.set()
+
+    def pump(self):
+        log = None
+        if self.log_file:
+            log = BoundedLog(self.log_file)
+        try:
+            for raw in iter(self.process.stdout.readline, b''):
+                line = raw.decode('UTF-8', 'replace').rstrip()
+                if log:
+                    log.write(line)
+                for listener in self.listeners:
+                    listener(line)
+                if self.queued:
+                    self.lines.put(line)
+            self.process.stdout.close()
+            self.returncode = self.reap()
+        finally:
+            # waiters (and the scheduler holding the reservation) must not depend on callbacks
+            try:
+                if log:
+                    log.close()
+                self.finished = time.time()
+                self.run_finish_callbacks()
+            finally:
+                self.finished_event.set()
+
+    def run_finish_callbacks(self):
+        for callback in self.finish_callbacks:
+            try:
+                callback(self)
+            except Exception as e:
+                print("Warning: finish callback of CAVER job failed: " + str(e))
+
+    # waits for the process, measuring its peak memory where possible
+    def reap(self):
+        if not hasattr(os, "wait4"):
+            return self.process.wait()
+        try:
+            pid, status, usage = os.wait4(self.process.pid, 0)
+        except OSError:
+            # already reaped by poll() in kill_tree
+            return self.process.wait()
+        if os.WIFSIGNALED(status):
+            code = -os.WTERMSIG(status)
+        else:
+            code = os.WEXITSTATUS(status)
+        self.process.returncode = code
+        # ru_maxrss is in bytes on macOS, in kilobytes elsewhere
+        if sys.platform == 'darwin':
+            self.peak_mb = usage.ru_maxrss // (1024 * 1024)
+        else:
+            self.peak_mb = usage.ru_maxrss // 1024
+        return code
+
+    def cancel(self):
+        self.cancelled = True
+        if self.process is None:
+            # not started yet, the scheduler drops it
+            return
+        # killing waits for the process to exit, keep that off the Tk thread
+        killer = threading.Thread(target=kill_tree, args=(self.process,))
+        killer.daemon = True
+        killer.start()
+
+    # waiting for resources or running
+    def running(self):
+        return not self.finished_event.is_set()
+
+    def waiting(self):
+        return self.started is None and not self.finished_event.is_set()
+
+    def done(self):
+        return self.finished_event.is_set() and self.lines.empty()
+
+    def wait(self):
+        self.finished_event.wait()
+        if self.thread is not None:
+            self.thread.join()
+        return self.returncode
+
+    # returns at most limit lines that are waiting in the queue
+    def read_lines(self, limit=200):
+        result = []
+        while len(result) < limit:
+            try:
+                result.append(self.lines.get_nowait())
+            except queue.Empty:
+                break
+        return result
+
+    def elapsed(self):
+        if self.started is None:
+            return 0
+        end = self.finished if self.finished is not None else time.time()
+        return end - self.started
@@ -0,0 +1,403 @@
+#
+# Java runtime helpers: locating java, parsing its version and caching
+# the results of expensive probes between PyMOL sessions.
+#
+
+import glob
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import subprocess
+import threading
+import time
+import zipfile
+
+try:
+    from shutil import which
+except ImportError:
+    from distutils.spawn import find_executable as which
+
+CACHE_LOCATION = os.path.join(os.path.expanduser("~"), ".caver3_plugin")
+
+HEAP_CACHE = "heap_probe.json"
+
+# class data sharing archives are kept next to caver.jar when possible
+CDS_LOCATION = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cds")
+
+# oldest Java able to dump archives of application classes (AppCDS)
+CDS_MIN_JAVA = 11
+
+# heaps from this size (MB) are committed up front (-Xms = -Xmx)
+BIG_HEAP = 2000
+
+# -Xmx values (MB) tried by the heap probe, the requested maximum is added
+HEAP_VALUES = [500, 800, 900, 950, 1000, 1050, 1100, 1150, 1200, 1250, 1300, 1400, 1500, 2000, 3000, 4000, 5000, 6000, 8000, 10000, 14000, 16000, 20000, 32000, 48000, 64000]
+
+
+def java_path(java="java"):
+    path = which(java)
+    if path is None:
+        return java
+    return os.path.realpath(path)
+
+
+def parse_version(output):
+    m = re.search(r'version "([^"]+)"', output)
+    if m is None:
+        return None
+    return m.group(1)
+
+
+def load_cache(name):
+    path = os.path.join(CACHE_LOCATION, name)
+    if not os.path.isfile(path):
+        return {}
+    try:
+        with open(path) as handler:
+            return json.load(handler)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def save_cache(name, data):
+    try:
+        if not os.path.isdir(CACHE_LOCATION):
+            os.makedirs(CACHE_LOCATION)
+        path = os.path.join(CACHE_LOCATION, name)
+        tmp = path + ".tmp"
+        with open(tmp, 'w') as handler:
+            json.dump(data, handler, indent=1, sort_keys=True)
+        if os.path.exists(path):
+            os.remove(path)
+        os.rename(tmp, path)
+    except (IOError, OSError) as e:
+        print("Warning: cannot write cache " + name + ": " + str(e))
+
+
+def heap_key(java, version, max_xmx):
+    return "%s|%s|%d" % (java, version, max_xmx)
+
+
+def cached_heap(java, version, max_xmx):
+    return load_cache(HEAP_CACHE).get(heap_key(java, version, max_xmx))
+
+
+def store_heap(java, version, max_xmx, xmx):
+    data = load_cache(HEAP_CACHE)
+    data[heap_key(java, version, max_xmx)] = xmx
+    save_cache(HEAP_CACHE, data)
+
+
+def heap_candidates(max_xmx):
+    values = sorted(set(HEAP_VALUES + [max_xmx]))
+    return [v for v in values if v <= max_xmx]
+
+
+# largest value for which works(value) succeeds, assuming that a heap which
+# can be allocated implies that all smaller heaps can be allocated too
+def largest_working(values, works):
+    low = 0
+    high = len(values) - 1
+    best = None
+    while low <= high:
+        mid = (low + high) // 2
+        if works(values[mid]):
+            best = mid
+            low = mid + 1
+        else:
+            high = mid - 1
+    if best is None:
+        return None
+    return values[best]
+
+
+class JavaInfo:
+    def __init__(self, java, home, version, bits, cores, seconds):
+        self.java = java
+        self.home = home
+        self.version = version
+        self.bits = bits
+        self.cores = cores
+        # how long the discovery took, i.e. what each later run saves
+        self.seconds = seconds
+
+    def major(self):
+        return major_version(self.version)
+
+    def describe(self):
+        return "Java %s (%s-bit, %s) at %s, %d cores" % (self.version, self.bits, self.home, self.java, self.cores)
+
+
+def major_version(version):
+    if not version:
+        return 0
+    parts = re.split(r"[._+-]", version)
+    if parts[0] == "1" and len(parts) > 1:
+        parts = parts[1:]
+    try:
+        return int(parts[0])
+    except ValueError:
+        return 0
+
+
+def update_version(version):
+    m = re.search(r"_(\d+)", version or "")
+    if m is None:
+        return 0
+    return int(m.group(1))
+
+
+def available_cores():
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return multiprocessing.cpu_count()
+
+
+def physical_memory_mb():
+    try:
+        return os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") // (1024 * 1024)
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def parse_properties(output):
+    props = {}
+    for line in output.splitlines():
+        if " = " in line:
+            key, value = line.strip().split(" = ", 1)
+            props[key] = value
+    return props
+
+
+def discover(java="java"):
+    start = time.time()
+    path = java_path(java)
+    try:
+        output = subprocess.check_output([path, "-XshowSettings:properties", "-version"],
+                                         stderr=subprocess.STDOUT, stdin=subprocess.PIPE)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    output = output.decode('UTF-8', 'replace')
+    props = parse_properties(output)
+    version = props.get("java.version") or parse_version(output)
+    home = props.get("java.home") or os.environ.get("JAVA_HOME", "")
+    bits = props.get("sun.arch.data.model", "unknown")
+    return JavaInfo(path, home, version, bits, available_cores(), time.time() - start)
+
+
+_info = None
+_discovery = None
+
+
+# starts the discovery in background (called when the plugin is loaded)
+def discover_async():
+    global _discovery
+    if _discovery is None:
+        _discovery = threading.Thread(target=_discover_session)
+        _discovery.daemon = True
+        _discovery.start()
+
+
+def _discover_session():
+    global _info
+    _info = discover()
+    if _info is not None:
+        print("CAVER: found " + _info.describe())
+
+
+# JVM found during this session, the discovery is repeated while it fails
+def session_info():
+    global _discovery
+    if _discovery is not None:
+        _discovery.join()
+        if _info is None:
+            _discovery = None
+    if _info is None:
+        _discover_session()
+    return _info
+
+
+# JVM flags for CAVER computations
+def launch_profile(info, xmx, cpus=None):
+    if cpus is None:
+        cpus = info.cores
+    major = info.major()
+    flags = ["-XX:+UseParallelGC", "-XX:+TieredCompilation"]
+    if major >= 10 or (major == 8 and update_version(info.version) >= 191):
+        flags.append("-XX:ActiveProcessorCount=%d" % cpus)
+    if xmx >= BIG_HEAP:
+        flags.append("-Xms%dm" % xmx)
+    return flags
+
+
+# JVM flags for short helper runs (e.g. heap probes), only startup matters
+def quick_profile(info):
+    return ["-XX:TieredStopAtLevel=1", "-XX:+UseSerialGC"]
+
+
+# garbage collections of a CAVER run are logged to this file in its output
+GC_LOG = "gc.log"
+
+# heap use before each collection, "65536K->1234K(251392K)" in the logs of
+# Java 8 (-Xloggc) and "64M->2M(245M)" in those of Java 9+ (-Xlog:gc)
+GC_HEAP_USE = re.compile(r"(\d+)([KMG])->\d+[KMG]\(\d+[KMG]\)")
+
+UNIT_MB = {"K": 1.0 / 1024, "M": 1.0, "G": 1024.0}
+
+
+# JVM flags writing a line per garbage collection to path
+def gc_log_flags(info, path):
+    if info.major() >= 9:
+        # drive letters would be taken for separators of -Xlog options
+        if ":" in path:
+            path = '"%s"' % path
+        return ["-Xlog:gc:file=" + path]
+    return ["-Xloggc:" + path]
+
+
+# largest heap use (MB) reported by the collector, None when no collection ran
+def gc_peak_mb(path):
+    if not os.path.isfile(path):
+        return None
+    peak = None
+    with open(path) as handler:
+        for line in handler:
+            for m in GC_HEAP_USE.finditer(line):
+                used = int(m.group(1)) * UNIT_MB[m.group(2)]
+                peak = used if peak is None else max(peak, used)
+    return None if peak is None else int(peak)
+
+
+def jar_classpath(caverjar):
+    jars = [caverjar]
+    home = os.path.dirname(caverjar)
+    with zipfile.ZipFile(caverjar) as jar:
+        manifest = jar.read("META-INF/MANIFEST.MF").decode('UTF-8')
+    # manifest lines are wrapped at 72 characters, continuations start with a space
+    manifest = manifest.replace("\r\n ", "").replace("\n ", "")
+    for line in manifest.splitlines():
+        if line.startswith("Class-Path:"):
+            for entry in line[len("Class-Path:"):].split():
+                jars.append(os.path.join(home, entry))
+    return jars
+
+
+def cds_fingerprint(info, jars, plugin_version):
+    h = hashlib.sha1()
+    h.update((info.java + "|" + str(info.version) + "|" + plugin_version).encode('UTF-8'))
+    for jar in jars:
+        if os.path.isfile(jar):
+            st = os.stat(jar)
+            h.update(("|%s|%d|%d" % (jar, st.st_size, int(st.st_mtime))).encode('UTF-8'))
+    return h.hexdigest()[:12]
+
+
+def cds_directory():
+    for d in [CDS_LOCATION, os.path.join(CACHE_LOCATION, "cds")]:
+        try:
+            if not os.path.isdir(d):
+                os.makedirs(d)
+            if os.access(d, os.W_OK):
+                return d
+        except OSError:
+            pass
+    return None
+
+
+def write_class_list(info, caverjar, jars, path):
+    # JDK classes loaded during startup, a custom archive replaces the default one
+    subprocess.call([info.java, "-XX:DumpLoadedClassList=" + path, "-jar", caverjar, "do_nothing"],
+                    stdout=subprocess.PIPE, stderr=subprocess.STDOUT, stdin=subprocess.PIPE)
+    names = []
+    if os.path.isfile(path):
+        with open(path) as handler:
+            names = [line.strip() for line in handler if line.strip() and not line.startswith("#")]
+    known = set(names)
+    for jar in jars:
+        if not os.path.isfile(jar):
+            continue
+        with zipfile.ZipFile(jar) as z:
+            for entry in z.namelist():
+                if entry.endswith(".class") and not entry.startswith("META-INF") and entry != "module-info.class":
+                    name = entry[:-len(".class")]
+                    if name not in known:
+                        known.add(name)
+                        names.append(name)
+    with open(path, 'w') as handler:
+        handler.write("\n".join(names))
+        handler.write("\n")
+
+
+# archives of one java binary share this prefix, others are left alone
+def cds_prefix(info):
+    return "caver_" + hashlib.sha1(info.java.encode('UTF-8')).hexdigest()[:8]
+
+
+_cds_builds = {}
+_cds_lock = threading.Lock()
+
+
+# returns the archive for given JVM and caver.jar, None while it is built in background
+def cds_archive(info, caverjar, plugin_version):
+    if info.major() < CDS_MIN_JAVA:
+        return None
+    jars = jar_classpath(caverjar)
+    d = cds_directory()
+    if d is None:
+        return None
+    version = re.sub(r"[^0-9A-Za-z.]", "_", str(info.version))
+    archive = os.path.join(d, "%s_%s_java%s_%s.jsa" % (cds_prefix(info), plugin_version, version,
+                                                      cds_fingerprint(info, jars, plugin_version)))
+    if os.path.isfile(archive):
+        return archive
+    # a failed build is not repeated in the same session
+    with _cds_lock:
+        if archive not in _cds_builds:
+            thread = threading.Thread(target=build_cds_archive, args=(info, caverjar, jars, archive))
+            thread.daemon = True
+            _cds_builds[archive] = thread
+            thread.start()
+    return None
+
+
+def build_cds_archive(info, caverjar, jars, archive):
+    # archives of older jars or plugins for the same JVM are stale
+    prefix = os.path.join(os.path.dirname(archive), cds_prefix(info) + "_")
+    for old in glob.glob(prefix + "*.jsa"):
+        if old != archive:
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+    print("*** Building class data sharing archive " + archive + " ***")
+    start = time.time()
+    # other processes may build the same archive, it appears complete or not at all
+    partial = "%s.%d.tmp" % (archive, os.getpid())
+    classlist = archive[:-len(".jsa")] + ".%d.classlist" % os.getpid()
+    try:
+        write_class_list(info, caverjar, jars, classlist)
+        code = subprocess.call([info.java, "-Xshare:dump", "-XX:SharedClassListFile=" + classlist,
+                                "-XX:SharedArchiveFile=" + partial, "-cp", caverjar],
+                               stdout=subprocess.PIPE, stderr=subprocess.STDOUT, stdin=subprocess.PIPE)
+        if code == 0 and os.path.isfile(partial) and not os.path.isfile(archive):
+            os.rename(partial, archive)
+    except (OSError, IOError) as e:
+        print("Warning: cannot build class data sharing archive: " + str(e))
+        return
+    finally:
+        for path in [classlist, partial]:
+            if os.path.exists(path):
+                os.remove(path)
+    if not os.path.isfile(archive):
+        print("Warning: class data sharing archive was not created, JVM startup will not be optimized.")
+        return
+    print("*** Archive built in %.1f s, used by the next computations ***" % (time.time() - start))
+
+
+def cds_flags(archive):
+    if archive is None:
+        return []
+    # -Xshare:auto makes the JVM ignore an archive it cannot map
+    return ["-Xshare:auto", "-XX:SharedArchiveFile=" + archive]
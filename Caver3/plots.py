@@ -0,0 +1,253 @@
+#
+# Heat maps and histograms rendered on demand
+#
+# In the lazy mode Java draws no images (heat maps and histograms are
+# switched off in the config), the plugin renders them from
+# analysis/tunnel_characteristics.csv and analysis/tunnel_profiles.csv when
+# they are opened. Rendered plots are kept as PNG files in analysis/plots
+# and drawn again only when their source CSV is newer.
+#
+
+import csv
+import os
+import struct
+import zlib
+
+from .configfile import config_values
+
+ANALYSIS_SUBDIR = "analysis"
+PLOTS_SUBDIR = "plots"
+CHARACTERISTICS = "tunnel_characteristics.csv"
+PROFILES = "tunnel_profiles.csv"
+
+# config changes of the lazy mode, the CSV sources are still needed
+LAZY_CHANGES = {"generate_profile_heat_map": "no", "generate_bottleneck_heat_map": "no",
+                "generate_histograms": "no", "generate_tunnel_profiles": "yes",
+                "generate_tunnel_characteristics": "yes"}
+
+BOTTLENECK_HEAT_MAP = "bottleneck_heat_map"
+PROFILE_HEAT_MAP = "profile_heat_map"
+BOTTLENECK_HISTOGRAM = "bottleneck_histogram"
+THROUGHPUT_HISTOGRAM = "throughput_histogram"
+
+# defaults of CAVER for parameters missing in the config
+DEFAULTS = {"profile_heat_map_resolution": "0.5", "profile_heat_map_range": "1.0 2.0",
+            "profile_heat_map_element_size": "20 10", "bottleneck_heat_map_range": "1.0 2.0",
+            "bottleneck_heat_map_element_size": "10 10", "bottleneck_histogram": "0.0 2.0 20",
+            "throughput_histogram": "0 1.0 10"}
+
+# images larger than this are scaled down to keep them displayable
+MAX_SIDE = 4000
+
+HISTOGRAM_BAR = 16
+HISTOGRAM_HEIGHT = 200
+
+MISSING = (224, 224, 224)
+BAR = (60, 90, 180)
+BACKGROUND = (255, 255, 255)
+
+
+def analysis_file(out_dir, name):
+    return os.path.join(out_dir, ANALYSIS_SUBDIR, name)
+
+
+def has_sources(out_dir):
+    return os.path.isfile(analysis_file(out_dir, CHARACTERISTICS))
+
+
+def parameter(values, key):
+    return [float(x) for x in values.get(key, DEFAULTS[key]).split()]
+
+
+# (snapshot, cluster, throughput, bottleneck radius) of all tunnels
+def characteristics(out_dir):
+    rows = []
+    with open(analysis_file(out_dir, CHARACTERISTICS)) as handler:
+        for row in csv.DictReader(handler, skipinitialspace=True):
+            row = dict([(k.strip(), v) for k, v in row.items() if k is not None])
+            rows.append((int(row["Snapshot"]), int(row["Tunnel cluster"]),
+                         float(row["Throughput"]), float(row["Bottleneck radius"])))
+    return rows
+
+
+# {snapshot: (lengths, radii)} of the tunnels of cluster, first tunnel of each snapshot
+def profiles(out_dir, cluster):
+    result = {}
+    axes = {}
+    with open(analysis_file(out_dir, PROFILES)) as handler:
+        reader = csv.reader(handler, skipinitialspace=True)
+        header = [h.strip() for h in next(reader)]
+        axis = header.index("Axis")
+        for row in reader:
+            if len(row) <= axis or int(row[1]) != cluster:
+                continue
+            key = (int(row[0]), row[2].strip())
+            axes.setdefault(key, {})[row[axis].strip()] = [float(v) for v in row[axis + 1:] if v.strip()]
+    for (snapshot, tunnel), values in sorted(axes.items()):
+        if snapshot not in result and "R" in values and "length" in values:
+            result[snapshot] = (values["length"], values["R"])
+    return result
+
+
+def clusters(out_dir):
+    return sorted(set([c for s, c, t, b in characteristics(out_dir)]))
+
+
+# red for narrow, blue for wide places, white in the middle of the range
+def heat_color(value, low, high):
+    if value is None:
+        return MISSING
+    t = min(1.0, max(0.0, (value - low) / (high - low))) if high > low else 0.5
+    if t < 0.5:
+        f = t * 2
+        return (255, int(255 * f), int(255 * f))
+    f = (1.0 - t) * 2
+    return (int(255 * f), int(255 * f), 255)
+
+
+# grid is a list of rows of colors, element is (width, height) of one cell
+def grid_pixels(grid, element):
+    ew, eh = [max(1, int(e)) for e in element]
+    columns = max([len(row) for row in grid] or [0])
+    ew = max(1, min(ew, MAX_SIDE // max(1, columns)))
+    eh = max(1, min(eh, MAX_SIDE // max(1, len(grid))))
+    pixels = []
+    for row in grid:
+        line = bytearray()
+        for i in range(columns):
+            line.extend(bytearray(row[i] if i < len(row) else MISSING) * ew)
+        pixels.extend([line] * eh)
+    return pixels
+
+
+def write_png(path, pixels):
+    height = len(pixels)
+    width = len(pixels[0]) // 3 if pixels else 0
+    raw = b"".join([b"\x00" + bytes(line) for line in pixels])
+
+    def chunk(kind, data):
+        body = kind + data
+        return struct.pack(">I", len(data)) + body + struct.pack(">I", zlib.crc32(body) & 0xffffffff)
+
+    tmp = path + ".tmp"
+    with open(tmp, 'wb') as handler:
+        handler.write(b"\x89PNG\r\n\x1a\n")
+        handler.write(chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)))
+        handler.write(chunk(b"IDAT", zlib.compress(raw, 6)))
+        handler.write(chunk(b"IEND", b""))
+    if os.path.exists(path):
+        os.remove(path)
+    os.rename(tmp, path)
+
+
+# columns are snapshots, rows are clusters
+def bottleneck_heat_map(out_dir, values):
+    low, high = parameter(values, "bottleneck_heat_map_range")
+    rows = characteristics(out_dir)
+    snapshots = sorted(set([r[0] for r in rows]))
+    column = dict([(s, i) for i, s in enumerate(snapshots)])
+    radii = {}
+    for snapshot, cluster, throughput, bottleneck in rows:
+        radii.setdefault(cluster, [None] * len(snapshots))
+        current = radii[cluster][column[snapshot]]
+        if current is None or bottleneck > current:
+            radii[cluster][column[snapshot]] = bottleneck
+    grid = [[heat_color(r, low, high) for r in radii[c]] for c in sorted(radii)]
+    return grid_pixels(grid, parameter(values, "bottleneck_heat_map_element_size"))
+
+
+# columns are snapshots, rows are distances along the tunnel, the narrowest radius of each bin
+def profile_heat_map(out_dir, cluster, values):
+    resolution = parameter(values, "profile_heat_map_resolution")[0]
+    low, high = parameter(values, "profile_heat_map_range")
+    data = profiles(out_dir, cluster)
+    if not data:
+        raise ValueError("no profiles of cluster %d in %s" % (cluster, PROFILES))
+    first, last = min(data), max(data)
+    bins = 0
+    columns = []
+    for snapshot in range(first, last + 1):
+        column = []
+        if snapshot in data:
+            lengths, radii = data[snapshot]
+            for length, radius in zip(lengths, radii):
+                b = int(length / resolution)
+                while len(column) <= b:
+                    column.append(None)
+                if column[b] is None or radius < column[b]:
+                    column[b] = radius
+        bins = max(bins, len(column))
+        columns.append(column)
+    grid = []
+    for b in range(bins):
+        grid.append([heat_color(c[b] if b < len(c) else None, low, high) for c in columns])
+    return grid_pixels(grid, parameter(values, "profile_heat_map_element_size"))
+
+
+# spec is "min max bins" as in the config, values out of range are not counted
+def histogram_counts(data, spec):
+    low, high, bins = spec[0], spec[1], max(1, int(spec[2]))
+    counts = [0] * bins
+    width = (high - low) / bins
+    for value in data:
+        if width > 0 and low <= value < high:
+            counts[int((value - low) / width)] += 1
+    return counts
+
+
+def histogram(out_dir, cluster, kind, values):
+    index = 2 if kind == THROUGHPUT_HISTOGRAM else 3
+    data = [r[index] for r in characteristics(out_dir) if r[1] == cluster]
+    counts = histogram_counts(data, parameter(values, kind))
+    top = max(counts) or 1
+    pixels = []
+    for y in range(HISTOGRAM_HEIGHT, 0, -1):
+        line = bytearray()
+        for count in counts:
+            filled = count * HISTOGRAM_HEIGHT >= y * top
+            line.extend(bytearray(BAR if filled else BACKGROUND) * (HISTOGRAM_BAR - 1))
+            line.extend(bytearray(BACKGROUND))
+        pixels.append(line)
+    return pixels
+
+
+# (title, plot name) of everything which can be rendered for out_dir
+def available(out_dir):
+    items = [("Bottleneck heat map", BOTTLENECK_HEAT_MAP)]
+    for c in clusters(out_dir):
+        items.append(("Profile heat map of cluster %d" % c, "%s_%d" % (PROFILE_HEAT_MAP, c)))
+        items.append(("Bottleneck histogram of cluster %d" % c, "%s_%d" % (BOTTLENECK_HISTOGRAM, c)))
+        items.append(("Throughput histogram of cluster %d" % c, "%s_%d" % (THROUGHPUT_HISTOGRAM, c)))
+    return items
+
+
+def sources(name):
+    if name.startswith(PROFILE_HEAT_MAP):
+        return [PROFILES]
+    return [CHARACTERISTICS]
+
+
+# path of the PNG of plot name, rendered when it is missing or out of date
+def render(out_dir, name, cfg=None):
+    target_dir = os.path.join(out_dir, ANALYSIS_SUBDIR, PLOTS_SUBDIR)
+    path = os.path.join(target_dir, name + ".png")
+    inputs = [analysis_file(out_dir, fn) for fn in sources(name)]
+    if cfg is not None:
+        inputs.append(cfg)
+    if os.path.isfile(path) and all([os.path.getmtime(path) >= os.path.getmtime(p) for p in inputs]):
+        return path
+    values = config_values(cfg) if cfg is not None else {}
+    if name == BOTTLENECK_HEAT_MAP:
+        pixels = bottleneck_heat_map(out_dir, values)
+    else:
+        kind, cluster = name.rsplit("_", 1)
+        if kind == PROFILE_HEAT_MAP:
+            pixels = profile_heat_map(out_dir, int(cluster), values)
+        else:
+            pixels = histogram(out_dir, int(cluster), kind, values)
+    if not pixels or not pixels[0]:
+        raise ValueError("nothing to draw in " + name)
+    if not os.path.isdir(target_dir):
+        os.makedirs(target_dir)
+    write_png(path, pixels)
+    return path
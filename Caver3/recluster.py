@@ -0,0 +1,104 @@
+#
+# Re-clustering of tunnels computed by a previous run
+#
+# Tunnels of an earlier caver_output/N are linked into the new output
+# directory and loaded by CAVER (load_tunnels), so only clustering and
+# visualization run again. The cluster tree is loaded as well
+# (load_cluster_tree) when the parameters it depends on did not change,
+# then cutting it at a new clustering_threshold is all that remains.
+#
+
+import glob
+import os
+import shutil
+
+from .configfile import config_values, update_config
+from .resultcache import link_or_copy
+
+DATA_SUBDIR = "data"
+TUNNELS_SUBDIR = "tunnels"
+TREE_FILE = "tree.txt"
+
+# parameters of the tunnel distance used to build the cluster tree
+TREE_KEYS = ["clustering", "weighting_coefficient", "exclude_start_zone",
+             "exclude_end_zone", "min_middle_zone", "frame_clustering",
+             "frame_weighting_coefficient", "frame_clustering_threshold",
+             "frame_exclude_start_zone", "frame_exclude_end_zone", "frame_min_middle_zone",
+             "do_approximate_clustering", "cluster_by_hierarchical_clustering", "max_training_clusters"]
+
+
+def tunnels_dir(run_dir):
+    return os.path.join(run_dir, DATA_SUBDIR, TUNNELS_SUBDIR)
+
+
+def has_tunnels(run_dir):
+    d = tunnels_dir(run_dir)
+    return os.path.isdir(d) and len(os.listdir(d)) > 0
+
+
+# most recent run of out_home with computed tunnels, None if there is none
+def latest_run(out_home, exclude=None):
+    runs = []
+    if os.path.isdir(out_home):
+        for fn in os.listdir(out_home):
+            path = os.path.join(out_home, fn)
+            if fn.isdigit() and has_tunnels(path) and (exclude is None or os.path.abspath(path) != os.path.abspath(exclude)):
+                runs.append((int(fn), path))
+    if not runs:
+        return None
+    return max(runs)[1]
+
+
+# configuration the previous run was computed with (the last retry if any)
+def run_config(run_dir):
+    configs = glob.glob(os.path.join(run_dir, "inputs", "config_*.txt"))
+    if not configs:
+        return None
+    return max(configs, key=os.path.getmtime)
+
+
+def link_inputs(run_dir, inputs):
+    src = os.path.join(run_dir, "inputs")
+    for fn in sorted(os.listdir(src)):
+        if fn.lower().endswith((".pdb", ".ent")):
+            link_or_copy(os.path.join(src, fn), os.path.join(inputs, fn))
+
+
+# path of the cluster tree relative to run_dir, None if it was not saved
+def tree_file(run_dir):
+    for root, dirs, files in os.walk(run_dir):
+        if TREE_FILE in files:
+            return os.path.relpath(os.path.join(root, TREE_FILE), run_dir)
+    return None
+
+
+def tree_reusable(run_dir, cfg):
+    previous = run_config(run_dir)
+    if previous is None or tree_file(run_dir) is None:
+        return False
+    old = config_values(previous)
+    new = config_values(cfg)
+    return all([old.get(key) == new.get(key) for key in TREE_KEYS])
+
+
+# links tunnels of run_dir into out_dir and switches cfg to loading them,
+# returns True when the cluster tree is reused too
+def prepare(run_dir, out_dir, cfg):
+    src = os.path.join(run_dir, DATA_SUBDIR)
+    dst = os.path.join(out_dir, DATA_SUBDIR)
+    os.makedirs(os.path.join(dst, TUNNELS_SUBDIR))
+    # tunnel files are only read, linking them is safe and fast
+    for fn in os.listdir(tunnels_dir(run_dir)):
+        link_or_copy(os.path.join(tunnels_dir(run_dir), fn), os.path.join(dst, TUNNELS_SUBDIR, fn))
+    # other data files may be rewritten by CAVER, a link would modify the previous run
+    for fn in os.listdir(src):
+        if os.path.isfile(os.path.join(src, fn)):
+            shutil.copy2(os.path.join(src, fn), os.path.join(dst, fn))
+    load_tree = tree_reusable(run_dir, cfg)
+    tree = tree_file(run_dir)
+    if load_tree and not os.path.exists(os.path.join(out_dir, tree)):
+        if not os.path.isdir(os.path.dirname(os.path.join(out_dir, tree))):
+            os.makedirs(os.path.dirname(os.path.join(out_dir, tree)))
+        shutil.copy2(os.path.join(run_dir, tree), os.path.join(out_dir, tree))
+    update_config(cfg, cfg, {"load_tunnels": "yes", "load_cluster_tree": "yes" if load_tree else "no"})
+    return load_tree
@@ -0,0 +1,82 @@
+#
+# Recovery of CAVER computations which ran out of Java heap
+#
+# A failed computation is repeated once with the probed maximum heap (every
+# smaller step could be another long run ending out of memory), then with
+# fewer approximating balls and approximate clustering, which need less
+# memory at the cost of accuracy. All attempts are recorded in recovery.txt
+# of the output directory.
+#
+
+import os
+import shutil
+import time
+
+from .configfile import config_values
+
+RECOVERY_LOG = "recovery.txt"
+
+# accuracy tiers, number_of_approximating_balls tried in this order
+BALL_TIERS = [20, 12, 8, 6, 4]
+
+# attempts including the first one: the estimated heap, the maximum heap
+# and every accuracy tier
+MAX_ATTEMPTS = 2 + len(BALL_TIERS)
+
+# files of the output directory which survive a retry
+KEPT = ("inputs", RECOVERY_LOG)
+
+
+def lower_tier(balls):
+    for tier in BALL_TIERS:
+        if tier < balls:
+            return tier
+    return None
+
+
+# returns (xmx, config changes) of the next attempt or None when giving up
+def next_attempt(attempt, xmx, max_xmx, balls):
+    if attempt >= MAX_ATTEMPTS:
+        return None
+    if xmx < max_xmx:
+        return max_xmx, {}
+    tier = lower_tier(balls)
+    if tier is None:
+        return None
+    return xmx, {"number_of_approximating_balls": tier, "do_approximate_clustering": "yes"}
+
+
+def retry_config(cfg, attempt):
+    base, ext = os.path.splitext(cfg)
+    if "_retry" in base:
+        base = base[:base.rfind("_retry")]
+    return "%s_retry%d%s" % (base, attempt, ext)
+
+
+# removes partial results of a failed attempt
+def clean_out_dir(out_dir, keep=KEPT):
+    for fn in os.listdir(out_dir):
+        if fn in keep:
+            continue
+        path = os.path.join(out_dir, fn)
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            os.remove(path)
+
+
+def describe(attempt, xmx, cfg):
+    values = config_values(cfg)
+    return "attempt %d: xmx=%d MB, number_of_approximating_balls=%s, do_approximate_clustering=%s, config=%s" % (
+        attempt, xmx, values.get("number_of_approximating_balls", "12"),
+        values.get("do_approximate_clustering", "no"), os.path.basename(cfg))
+
+
+def record(out_dir, attempt, xmx, cfg, result):
+    line = "%s %s, result=%s\n" % (time.strftime("%Y-%m-%d %H:%M:%S"), describe(attempt, xmx, cfg), result)
+    try:
+        handler = open(os.path.join(out_dir, RECOVERY_LOG), 'a')
+        handler.write(line)
+        handler.close()
+    except (IOError, OSError) as e:
+        print("Warning: cannot record recovery attempt: " + str(e))
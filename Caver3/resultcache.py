@@ -0,0 +1,173 @@
+#
+# Cache of finished CAVER computations
+#
+# A computation is identified by a hash of its input structures and of the
+# normalized configuration. Results are hard-linked (or copied when links
+# are not possible) into caver_output/.cache, entries are evicted in least
+# recently used order once the cache grows over its size limit.
+#
+
+import hashlib
+import json
+import os
+import shutil
+import time
+
+from .configfile import parse_config
+
+CACHE_SUBDIR = ".cache"
+INDEX = "index.json"
+
+# parameters not influencing results of the computation
+IGNORED_KEYS = ["java_heap", "path_to_vmd"]
+
+# scripts containing absolute paths of the output directory
+REWRITTEN_SUFFIXES = (".py", ".tcl", ".sh", ".bat")
+
+
+def normalized_config(path):
+    keys, values = parse_config(path)
+    lines = []
+    for key in sorted(keys):
+        if key not in IGNORED_KEYS and values[key] != "":
+            lines.append(key + " " + " ".join(values[key].split()))
+    return "\n".join(lines)
+
+
+def hash_inputs(h, input_dir):
+    for fn in sorted(os.listdir(input_dir)):
+        path = os.path.join(input_dir, fn)
+        if not fn.lower().endswith((".pdb", ".ent")) or not os.path.isfile(path):
+            continue
+        h.update(fn.encode('UTF-8'))
+        with open(path, 'rb') as handler:
+            for block in iter(lambda: handler.read(1 << 20), b''):
+                h.update(block)
+
+
+def inputs_digest(input_dir):
+    h = hashlib.sha256()
+    hash_inputs(h, input_dir)
+    return h.hexdigest()
+
+
+def job_key(input_dir, config_path):
+    h = hashlib.sha256()
+    hash_inputs(h, input_dir)
+    h.update(normalized_config(config_path).encode('UTF-8'))
+    return h.hexdigest()
+
+
+def link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except (OSError, AttributeError):
+        shutil.copy2(src, dst)
+
+
+def tree_size(path):
+    size = 0
+    for root, dirs, files in os.walk(path):
+        for fn in files:
+            size += os.path.getsize(os.path.join(root, fn))
+    return size
+
+
+class ResultCache:
+    def __init__(self, out_home, limit_mb):
+        self.root = os.path.join(out_home, CACHE_SUBDIR)
+        self.limit = int(limit_mb) * 1024 * 1024
+
+    def load_index(self):
+        path = os.path.join(self.root, INDEX)
+        if not os.path.isfile(path):
+            return {}
+        try:
+            with open(path) as handler:
+                return json.load(handler)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def save_index(self, index):
+        if not os.path.isdir(self.root):
+            os.makedirs(self.root)
+        path = os.path.join(self.root, INDEX)
+        with open(path + ".tmp", 'w') as handler:
+            json.dump(index, handler, indent=1, sort_keys=True)
+        if os.path.exists(path):
+            os.remove(path)
+        os.rename(path + ".tmp", path)
+
+    def entry_dir(self, key):
+        return os.path.join(self.root, key)
+
+    def lookup(self, key):
+        index = self.load_index()
+        entry = index.get(key)
+        if entry is None or not os.path.isdir(self.entry_dir(key)):
+            return None
+        entry["last_used"] = time.time()
+        self.save_index(index)
+        return entry
+
+    # inputs are not cached, they are exported again for each computation
+    def store(self, key, out_dir, skip=("inputs",)):
+        target = self.entry_dir(key)
+        if os.path.isdir(target):
+            shutil.rmtree(target)
+        for root, dirs, files in os.walk(out_dir):
+            rel = os.path.relpath(root, out_dir)
+            if rel == ".":
+                dirs[:] = [d for d in dirs if d not in skip]
+            dst = os.path.normpath(os.path.join(target, rel))
+            if not os.path.isdir(dst):
+                os.makedirs(dst)
+            for fn in files:
+                link_or_copy(os.path.join(root, fn), os.path.join(dst, fn))
+        index = self.load_index()
+        index[key] = {
+            "out_dir": os.path.abspath(out_dir),
+            "size": tree_size(target),
+            "last_used": time.time(),
+        }
+        self.save_index(index)
+        self.evict(index)
+
+    def restore(self, key, entry, new_dir):
+        source = self.entry_dir(key)
+        old_dir = entry["out_dir"]
+        new_abs = os.path.abspath(new_dir)
+        for root, dirs, files in os.walk(source):
+            rel = os.path.relpath(root, source)
+            dst = os.path.normpath(os.path.join(new_dir, rel))
+            if not os.path.isdir(dst):
+                os.makedirs(dst)
+            for fn in files:
+                src = os.path.join(root, fn)
+                if fn.endswith(REWRITTEN_SUFFIXES):
+                    rewrite_paths(src, os.path.join(dst, fn), old_dir, new_abs)
+                else:
+                    link_or_copy(src, os.path.join(dst, fn))
+
+    def evict(self, index=None):
+        if index is None:
+            index = self.load_index()
+        total = sum([e["size"] for e in index.values()])
+        for key in sorted(index, key=lambda k: index[k]["last_used"]):
+            if total <= self.limit:
+                break
+            total -= index[key]["size"]
+            del index[key]
+            shutil.rmtree(self.entry_dir(key), ignore_errors=True)
+            print("Result cache: evicted " + key)
+        self.save_index(index)
+
+
+def rewrite_paths(src, dst, old_dir, new_dir):
+    with open(src, 'rb') as handler:
+        content = handler.read()
+    for old, new in [(old_dir, new_dir),
+                     (old_dir.replace("\\", "/"), new_dir.replace("\\", "/"))]:
+        content = content.replace(old.encode('UTF-8'), new.encode('UTF-8'))
+    with open(dst, 'wb') as handler:
+        handler.write(content)
@@ -0,0 +1,150 @@
+#
+# Memory and CPU aware scheduling of concurrent CAVER JVMs
+#
+# Every Java launch reserves its heap (plus JVM overhead) and a number of
+# cores from a global budget and waits in a FIFO queue until the
+# reservation fits, so concurrent jobs do not make the machine swap.
+#
+
+import os
+import threading
+import time
+
+from . import jvm
+
+# memory used by a JVM beyond its heap (MB)
+JVM_OVERHEAD_MB = 200
+
+# cores reserved for one CAVER job, mostly single threaded plus GC threads
+JOB_CPUS = 2
+
+# part of physical memory available to CAVER jobs by default
+MEMORY_FRACTION = 0.8
+
+# seconds between checks whether a queued job was cancelled
+WAIT_STEP = 0.5
+
+
+class ResourceBudget:
+    def __init__(self, heap_mb=None, cpus=None, pin=False):
+        if heap_mb is None:
+            memory = jvm.physical_memory_mb()
+            heap_mb = int(memory * MEMORY_FRACTION) if memory else 4000
+        if hasattr(os, "sched_getaffinity"):
+            cpu_ids = sorted(os.sched_getaffinity(0))
+        else:
+            cpu_ids = list(range(jvm.available_cores()))
+            pin = False
+        if cpus is not None:
+            cpu_ids = cpu_ids[:cpus]
+        self.heap = heap_mb
+        self.cpus = len(cpu_ids)
+        self.pin = pin
+        self.free_heap = heap_mb
+        self.free_cpus = cpu_ids
+        self.queue = []
+        self.requests = {}
+        self.tokens = 0
+        self.condition = threading.Condition()
+
+    # a job larger than the whole budget would never start, it runs alone
+    def clamp(self, heap_mb, cpus):
+        return min(heap_mb, self.heap), max(1, min(cpus, self.cpus))
+
+    # queues a reservation, returns its token for acquire() or withdraw()
+    def request(self, heap_mb, cpus=1):
+        heap_mb, cpus = self.clamp(heap_mb, cpus)
+        with self.condition:
+            self.tokens += 1
+            self.queue.append(self.tokens)
+            self.requests[self.tokens] = (heap_mb, cpus)
+            return self.tokens
+
+    # waits at most timeout seconds until the queued reservation fits, returns
+    # (heap, cpus, pinned cores or None, cores) or None when it does not fit yet;
+    # the token keeps its place in the queue, arguments are plain values so
+    # the budget can be shared through a multiprocessing manager
+    def acquire(self, token, timeout=None):
+        with self.condition:
+            heap_mb, cpus = self.requests[token]
+            deadline = None if timeout is None else time.time() + timeout
+            while self.queue[0] != token or heap_mb > self.free_heap or cpus > len(self.free_cpus):
+                remaining = 0.5 if deadline is None else min(0.5, deadline - time.time())
+                if remaining <= 0:
+                    return None
+                self.condition.wait(remaining)
+            self.queue.pop(0)
+            del self.requests[token]
+            self.free_heap -= heap_mb
+            cpu_set = self.free_cpus[:cpus]
+            self.free_cpus = self.free_cpus[cpus:]
+            self.condition.notify_all()
+            return (heap_mb, cpus, cpu_set if self.pin else None, cpu_set)
+
+    def withdraw(self, token):
+        with self.condition:
+            if token in self.requests:
+                self.queue.remove(token)
+                del self.requests[token]
+                self.condition.notify_all()
+
+    def release(self, reservation):
+        heap_mb, cpus, pinned, cpu_set = reservation
+        with self.condition:
+            self.free_heap += heap_mb
+            self.free_cpus = sorted(self.free_cpus + cpu_set)
+            self.condition.notify_all()
+
+    def usage(self):
+        with self.condition:
+            return "%d/%d MB, %d/%d cores used, %d waiting" % (self.heap - self.free_heap, self.heap,
+                self.cpus - len(self.free_cpus), self.cpus, len(self.queue))
+
+
+_budget = None
+
+
+def default_budget():
+    global _budget
+    if _budget is None:
+        _budget = ResourceBudget()
+    return _budget
+
+
+# starts job in background as soon as the budget allows, returns the job
+def launch(job, budget, heap_mb, cpus=JOB_CPUS):
+    thread = threading.Thread(target=run, args=(job, budget, heap_mb, cpus))
+    thread.daemon = True
+    thread.start()
+    return job
+
+
+# cancellation is checked here, between short waits for the budget
+def run(job, budget, heap_mb, cpus):
+    held = {}
+    try:
+        held["token"] = budget.request(heap_mb, cpus)
+        reservation = None
+        while reservation is None:
+            if job.cancelled:
+                free(budget, held)
+                job.fail(None)
+                return
+            reservation = budget.acquire(held["token"], WAIT_STEP)
+        held["reservation"] = reservation
+        job.cpu_set = reservation[2]
+        job.start()
+        job.wait()
+    except Exception as e:
+        # resources are returned before the waiting caller is woken up
+        free(budget, held)
+        job.fail(e)
+    finally:
+        free(budget, held)
+
+
+def free(budget, held):
+    if "reservation" in held:
+        budget.release(held.pop("reservation"))
+    elif "token" in held:
+        budget.withdraw(held.pop("token"))
@@ -0,0 +1,105 @@
+#
+# Cluster tree of a finished run (clustertree.py)
+#
+# data/caver_run holds the outputs of a run with 6 tunnels in 3 snapshots,
+# every tunnel a grain of its own, clustered at threshold 3.5 into clusters
+# 1 (3 tunnels), 2 (2 tunnels) and 3 (1 tunnel). tree.txt follows
+# AverageLinkClusteringMurtagh.saveTreeCompatible of lib/AverageLinkClustering.jar
+# (tab separated, leaves 1..n, parents from n + 1, float distances),
+# tunnel_characteristics.csv the header written by caver.ui.Statistics.
+#
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from Caver3 import clustertree
+
+RUN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "caver_run")
+THRESHOLD = 3.5
+
+
+def load_run():
+    tunnels = clustertree.output_tunnels(RUN)
+    tree = clustertree.ClusterTree.load(clustertree.find_tree(RUN), len(tunnels))
+    return tree, tunnels
+
+
+class ClusterTreeTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def tree_file(self, lines):
+        path = os.path.join(self.tmp, clustertree.TREE_FILE)
+        with open(path, 'w') as handler:
+            handler.write("".join([line + "\n" for line in lines]))
+        return path
+
+    def test_load(self):
+        tree, tunnels = load_run()
+        self.assertEqual(tree.leaves, 6)
+        self.assertEqual(list(tree.height), [0.8, 1.2, 2.0, 4.1, 6.3])
+        self.assertEqual(tree.range(), (0.8, 6.3))
+
+    def test_cut(self):
+        tree, tunnels = load_run()
+        self.assertEqual(list(tree.cut(THRESHOLD)), [0, 1, 0, 0, 2, 1])
+        self.assertEqual(tree.count(THRESHOLD), 3)
+        # CAVER stops at the first merge not below the threshold
+        self.assertEqual(tree.count(4.1), 3)
+        self.assertEqual(tree.count(5.0), 2)
+        self.assertEqual(list(tree.cut(0.5)), [0, 1, 2, 3, 4, 5])
+        self.assertEqual(tree.count(10.0), 1)
+
+    def test_leaves_never_merged(self):
+        # leaf 4 of 4 is not in the file, parents are numbered from 5
+        tree = clustertree.ClusterTree.load(self.tree_file(["1\t3\t0.5\t5", "5\t2\t1.5\t6"]))
+        self.assertEqual(tree.leaves, 4)
+        self.assertEqual(list(tree.cut(10.0)), [0, 0, 0, 1])
+
+    def test_output_tunnels(self):
+        tunnels = clustertree.output_tunnels(RUN)
+        self.assertEqual(len(tunnels), 6)
+        self.assertEqual(sorted(tunnels)[0], (0.51225, 1))
+
+    def test_match_by_cost(self):
+        tree, tunnels = load_run()
+        labels, matched = clustertree.match_clusters(tree, THRESHOLD, tunnels)
+        self.assertEqual(matched, {0: 1, 1: 2, 2: 3})
+
+    def test_match_by_size_when_costs_tie(self):
+        tree, tunnels = load_run()
+        tied = [(1.0, cluster) for cost, cluster in tunnels]
+        labels, matched = clustertree.match_clusters(tree, THRESHOLD, tied)
+        self.assertEqual(matched, {0: 1, 1: 2, 2: 3})
+
+    def test_ambiguous_sizes(self):
+        tree = clustertree.ClusterTree.load(self.tree_file(["1\t2\t0.5\t5", "3\t4\t0.7\t6", "5\t6\t2.0\t7"]))
+        tunnels = [(1.0, 1), (1.0, 2), (1.0, 1), (1.0, 2)]
+        labels, matched = clustertree.match_clusters(tree, 1.0, tunnels)
+        self.assertIsNone(matched)
+
+    def test_grains(self):
+        # 6 tunnels in 5 grains, leaves do not identify tunnels
+        tree = clustertree.ClusterTree.load(self.tree_file(["1\t3\t0.8\t6", "2\t5\t1.2\t7"]))
+        tunnels = clustertree.output_tunnels(RUN)
+        labels, matched = clustertree.match_clusters(tree, THRESHOLD, tunnels)
+        self.assertIsNone(matched)
+
+    def test_regroup(self):
+        tree, tunnels = load_run()
+        labels, matched = clustertree.match_clusters(tree, THRESHOLD, tunnels)
+        self.assertEqual(clustertree.regroup(tree, labels, matched, 5.0), ([[1, 3], [2]], []))
+        self.assertEqual(clustertree.regroup(tree, labels, matched, 1.0), ([[1], [2], [3]], [1, 2]))
+
+    def test_cluster_objects(self):
+        names = ["c1_t001_0", "c1_t001_1", "c1_t002_0", "c2_t001_0", "protein"]
+        self.assertEqual(clustertree.cluster_objects("c1", names), {1: ["c1_t001_0", "c1_t001_1"], 2: ["c1_t002_0"]})
+
+
+if __name__ == "__main__":
+    unittest.main()
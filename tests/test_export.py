@@ -0,0 +1,72 @@
+#
+# Column layout of PDB records written by export.PdbWriter (replaces cmd.save)
+#
+
+import io
+import unittest
+
+from Caver3.export import PdbWriter
+
+
+def atom_line(**fields):
+    atom = {"type": "ATOM", "name": "CA", "alt": "", "resn": "ALA", "chain": "A", "resi": "12", "resv": 12,
+            "x": 1.5, "y": -2.25, "z": 10.125, "q": 1.0, "b": 20.5, "elem": "C", "segi": "", "formal_charge": 0}
+    atom.update(fields)
+    handler = io.StringIO()
+    writer = PdbWriter(handler)
+    writer.atom(**atom)
+    return handler.getvalue().splitlines()[0]
+
+
+class PdbWriterTest(unittest.TestCase):
+    def test_columns(self):
+        line = atom_line()
+        self.assertEqual(line[0:6], "ATOM  ")
+        self.assertEqual(line[6:11], "    1")
+        self.assertEqual(line[12:16], " CA ")
+        self.assertEqual(line[17:20], "ALA")
+        self.assertEqual(line[21], "A")
+        self.assertEqual(line[22:26], "  12")
+        self.assertEqual(line[26], " ")
+        self.assertEqual(line[30:38], "   1.500")
+        self.assertEqual(line[38:46], "  -2.250")
+        self.assertEqual(line[46:54], "  10.125")
+        self.assertEqual(line[54:60], "  1.00")
+        self.assertEqual(line[60:66], " 20.50")
+        self.assertEqual(line[76:78], " C")
+
+    def test_negative_residue_number(self):
+        line = atom_line(resi="-3", resv=-3)
+        self.assertEqual(line[22:26], "  -3")
+
+    def test_residue_number_limits(self):
+        self.assertEqual(atom_line(resi="9999", resv=9999)[22:26], "9999")
+        self.assertEqual(atom_line(resi="-999", resv=-999)[22:26], "-999")
+
+    def test_residue_number_overflow(self):
+        handler = io.StringIO()
+        writer = PdbWriter(handler)
+        for resv in [10000, -1234, 10000]:
+            writer.atom("ATOM", "CA", "", "ALA", "A", str(resv), resv, 0.0, 0.0, 0.0, 1.0, 0.0, "C", "", 0)
+        writer.close()
+        self.assertEqual(writer.atoms, 0)
+        self.assertEqual(writer.overflow, [("", "A", "10000"), ("", "A", "-1234")])
+
+    def test_insertion_code(self):
+        line = atom_line(resi="52A", resv=52)
+        self.assertEqual(line[22:27], "  52A")
+
+    def test_alternate_locations(self):
+        handler = io.StringIO()
+        writer = PdbWriter(handler, first_altloc=True)
+        for alt in ["A", "B"]:
+            writer.atom("ATOM", "CA", alt, "SER", "A", "5", 5, 0.0, 0.0, 0.0, 0.5, 0.0, "C", "", 0)
+        writer.close()
+        lines = handler.getvalue().splitlines()
+        self.assertEqual(writer.atoms, 1)
+        self.assertEqual(lines[0][16], " ")
+        self.assertEqual(lines[1:], ["TER", "END"])
+
+
+if __name__ == "__main__":
+    unittest.main()
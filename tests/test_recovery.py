@@ -0,0 +1,45 @@
+#
+# Attempts of a computation which keeps running out of Java heap
+#
+
+import unittest
+
+from Caver3 import recovery
+from Caver3.heapmodel import MIN_HEAP_MB
+
+
+def walk(xmx, max_xmx, balls):
+    attempts = [(xmx, balls, "no")]
+    attempt = 1
+    while True:
+        result = recovery.next_attempt(attempt, xmx, max_xmx, balls)
+        if result is None:
+            return attempts
+        attempt += 1
+        xmx, changes = result
+        balls = changes.get("number_of_approximating_balls", balls)
+        attempts.append((xmx, balls, changes.get("do_approximate_clustering", attempts[-1][2])))
+
+
+class NextAttemptTest(unittest.TestCase):
+    def test_heap_then_ball_tiers(self):
+        attempts = walk(MIN_HEAP_MB, 6000, 12)
+        self.assertEqual(attempts[1], (6000, 12, "no"))
+        self.assertEqual([a[1] for a in attempts[2:]], [8, 6, 4])
+        self.assertTrue(all([a[2] == "yes" for a in attempts[2:]]))
+
+    def test_every_tier_within_max_attempts(self):
+        attempts = walk(MIN_HEAP_MB, 6000, 30)
+        self.assertEqual([a[1] for a in attempts[2:]], recovery.BALL_TIERS)
+        self.assertEqual(len(attempts), recovery.MAX_ATTEMPTS)
+
+    def test_estimate_at_maximum(self):
+        attempts = walk(6000, 6000, 12)
+        self.assertEqual(attempts[1], (6000, 8, "yes"))
+
+    def test_lowest_tier_gives_up(self):
+        self.assertIsNone(recovery.next_attempt(2, 6000, 6000, 4))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,139 @@
+#
+# Memory and CPU budget of concurrent CAVER jobs (scheduler.py)
+#
+
+import threading
+import unittest
+
+from Caver3 import scheduler
+from Caver3.batch import BudgetManager
+from Caver3.scheduler import ResourceBudget
+
+
+class FakeJob:
+    def __init__(self, start_error=None):
+        self.cancelled = False
+        self.cpu_set = None
+        self.error = None
+        self.failed = threading.Event()
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.start_error = start_error
+
+    def start(self):
+        if self.start_error is not None:
+            raise self.start_error
+        self.started.set()
+
+    def wait(self):
+        self.release.wait(5)
+        return 0
+
+    def fail(self, error):
+        self.error = error
+        self.failed.set()
+
+
+# budget of a machine with given number of cores, whatever this one has
+def make_budget(heap_mb, cores, pin=False):
+    budget = ResourceBudget(heap_mb, pin=pin)
+    budget.cpus = cores
+    budget.free_cpus = list(range(cores))
+    return budget
+
+
+def run_in_background(job, budget, heap_mb, cpus=1):
+    thread = threading.Thread(target=scheduler.run, args=(job, budget, heap_mb, cpus))
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+class ResourceBudgetTest(unittest.TestCase):
+    def test_acquire_and_release(self):
+        budget = make_budget(1000, 2)
+        reservation = budget.acquire(budget.request(600, 1))
+        self.assertEqual(reservation[:2], (600, 1))
+        self.assertIsNone(reservation[2])
+        self.assertEqual(budget.free_heap, 400)
+        budget.release(reservation)
+        self.assertEqual(budget.free_heap, 1000)
+        self.assertEqual(len(budget.free_cpus), 2)
+
+    def test_timeout_keeps_the_place_in_queue(self):
+        budget = make_budget(1000, 2)
+        first = budget.acquire(budget.request(800))
+        token = budget.request(800)
+        self.assertIsNone(budget.acquire(token, 0.05))
+        self.assertEqual(budget.queue, [token])
+        budget.release(first)
+        self.assertIsNotNone(budget.acquire(token, 1))
+
+    def test_first_in_first_out(self):
+        budget = make_budget(1000, 2)
+        first = budget.acquire(budget.request(800))
+        large = budget.request(800)
+        small = budget.request(100)
+        # the small job fits, but does not overtake the queued large one
+        self.assertIsNone(budget.acquire(small, 0.05))
+        budget.withdraw(large)
+        self.assertIsNotNone(budget.acquire(small, 1))
+        budget.release(first)
+
+    def test_larger_than_budget_runs_alone(self):
+        budget = make_budget(1000, 2)
+        reservation = budget.acquire(budget.request(5000, 8), 1)
+        self.assertEqual(reservation[:2], (1000, 2))
+
+    def test_pinned_cores(self):
+        budget = make_budget(1000, 1, pin=True)
+        reservation = budget.acquire(budget.request(100, 1))
+        self.assertEqual(reservation[2], reservation[3])
+        self.assertEqual(len(reservation[2]), 1)
+
+
+class RunTest(unittest.TestCase):
+    def check_run(self, budget):
+        job = FakeJob()
+        thread = run_in_background(job, budget, 600)
+        self.assertTrue(job.started.wait(5))
+        # the second job waits for the memory of the first one
+        second = FakeJob()
+        waiting = run_in_background(second, budget, 600)
+        self.assertFalse(second.started.wait(0.2))
+        second.cancelled = True
+        self.assertTrue(second.failed.wait(5))
+        self.assertIsNone(second.error)
+        job.release.set()
+        thread.join(5)
+        waiting.join(5)
+        self.assertFalse(thread.is_alive())
+
+    def test_run_and_cancel(self):
+        budget = make_budget(1000, 2)
+        self.check_run(budget)
+        self.assertEqual(budget.free_heap, 1000)
+        self.assertEqual(budget.queue, [])
+
+    def test_failed_start_returns_resources(self):
+        budget = make_budget(1000, 2)
+        job = FakeJob(OSError("java not found"))
+        run_in_background(job, budget, 600).join(5)
+        self.assertIsInstance(job.error, OSError)
+        self.assertEqual(budget.free_heap, 1000)
+
+    # python -m Caver3.batch shares the budget between processes
+    def test_run_through_manager(self):
+        manager = BudgetManager()
+        manager.start()
+        try:
+            budget = manager.ResourceBudget(1000, 1)
+            self.check_run(budget)
+            self.assertIn("0/1000 MB", budget.usage())
+            self.assertIn("0 waiting", budget.usage())
+        finally:
+            manager.shutdown()
+
+
+if __name__ == "__main__":
+    unittest.main()